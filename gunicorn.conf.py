@@ -0,0 +1,17 @@
+# Gunicorn settings for both deployment profiles; pick one with
+# SERVER_PROFILE (the same variable switches the URLconf to the async
+# views, see wishlist/settings.py).
+#   wsgi: sync workers, one request per worker process at a time.
+#   asgi: uvicorn workers, each serving many concurrent requests.
+import os
+
+profile = os.getenv('SERVER_PROFILE', 'wsgi')
+
+bind = '0.0.0.0:8000'
+workers = int(os.getenv('WEB_WORKERS', '3'))
+
+if profile == 'asgi':
+    wsgi_app = 'wishlist.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'wishlist.wsgi:application'
@@ -0,0 +1,307 @@
+"""Synthetic data, scenarios, load driving and latency statistics for the
+benchmark commands.
+
+``bench_seed`` fills the database with a reproducible dataset, ``bench``
+runs the scenarios against it and compares them with a saved baseline,
+``bench_http`` drives raw concurrency at a running server.
+"""
+import json
+import random
+import re
+import resource
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from itertools import cycle
+
+import requests
+from django.contrib.auth.hashers import make_password
+from django.db import connections, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.test import Client
+
+from users.models import CustomUser, WishlistItem
+from users.wishlist import remove_products
+
+from .cache import bump_generation
+from .feed import build_home_feed
+from .models import Category, Product, ProductImage, ProductSize, Size
+
+PREFIX = 'bench'
+BATCH_SIZE = 1000
+SIZES = ('XS', 'S', 'M', 'L', 'XL')
+COLORS = ('black', 'white', 'red', 'blue', 'green', 'beige')
+NOUNS = ('sneakers', 'jacket', 'hoodie', 'dress', 'bag', 'watch', 'scarf', 'boots')
+ADJECTIVES = ('classic', 'oversized', 'vintage', 'leather', 'cotton', 'wool', 'slim', 'sport')
+# Regressions past this many percent are flagged by compare().
+TOLERANCE = 10
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values``; 0 for an empty list."""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies, elapsed=None, errors=0):
+    """Latencies in seconds -> a dict of milliseconds (and req/s when
+    ``elapsed`` is given)."""
+    summary = {
+        'requests': len(latencies),
+        'errors': errors,
+        'mean_ms': statistics.fmean(latencies) * 1000 if latencies else 0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+    if elapsed:
+        summary['rps'] = len(latencies) / elapsed
+    return summary
+
+
+def drive_http(base_url, paths, total, concurrency, headers=None):
+    """Send ``total`` GETs over ``paths`` in turn from ``concurrency``
+    threads, each with its own keep-alive session, against a running
+    server. Returns ``summarize`` of the run."""
+    urls = cycle([base_url.rstrip('/') + path for path in paths])
+    lock = threading.Lock()
+    local = threading.local()
+    latencies, errors = [], 0
+
+    def fetch(_):
+        nonlocal errors
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        with lock:
+            url = next(urls)
+        started = time.perf_counter()
+        try:
+            ok = session.get(url, headers=headers, timeout=30).status_code < 400
+        except requests.RequestException:
+            ok = False
+        took = time.perf_counter() - started
+        with lock:
+            if ok:
+                latencies.append(took)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(fetch, range(total)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def clear_dataset():
+    """Delete everything seed_dataset created."""
+    WishlistItem.objects.filter(user__login__startswith=PREFIX).delete()
+    CustomUser.objects.filter(login__startswith=PREFIX).delete()
+    Product.objects.filter(slug__startswith=f'{PREFIX}-').delete()
+    Category.objects.filter(slug__startswith=f'{PREFIX}-').delete()
+
+
+@transaction.atomic
+def seed_dataset(categories, products, users, wishlist_size, images=3, seed=0):
+    """Create a reproducible synthetic catalog: ``products`` products over
+    ``categories`` categories, each with ``images`` extra images and a
+    random set of sizes, and ``users`` users with ``wishlist_size`` items
+    each. Rows are bulk inserted, so the caches are invalidated here
+    instead of by the model signals."""
+    rng = random.Random(seed)
+    clear_dataset()
+    sizes = [Size.objects.get_or_create(name=name)[0] for name in SIZES]
+
+    category_rows = Category.objects.bulk_create([
+        Category(name=f'Bench category {i}', slug=f'{PREFIX}-category-{i}', feed=True)
+        for i in range(categories)
+    ])
+    product_rows, product_sizes = [], []
+    for i in range(products):
+        stocked = rng.sample(sizes, rng.randint(1, len(sizes)))
+        product_rows.append(Product(
+            name=f'{rng.choice(ADJECTIVES).title()} {rng.choice(NOUNS)} {i}',
+            slug=f'{PREFIX}-product-{i}',
+            color=rng.choice(COLORS),
+            price=rng.randint(500, 50000),
+            description=f'Synthetic benchmark product {i}',
+            main_image='products/main/bench.jpg',
+            category=rng.choice(category_rows),
+            feed=True,
+            sizes_in_stock=sorted(size.name for size in stocked),
+        ))
+        product_sizes.append(stocked)
+    product_rows = Product.objects.bulk_create(product_rows, batch_size=BATCH_SIZE)
+    ProductImage.objects.bulk_create([
+        ProductImage(product=product, image='products/extra/bench.jpg')
+        for product in product_rows for _ in range(images)
+    ], batch_size=BATCH_SIZE)
+    ProductSize.objects.bulk_create([
+        ProductSize(product=product, size=size, stock=rng.randint(1, 20))
+        for product, stocked in zip(product_rows, product_sizes) for size in stocked
+    ], batch_size=BATCH_SIZE)
+
+    password = make_password(PREFIX)
+    user_rows = CustomUser.objects.bulk_create([
+        CustomUser(email=f'{PREFIX}{i}@example.com', login=f'{PREFIX}{i}', first_name='Bench',
+                   last_name=str(i), password=password, access=True)
+        for i in range(users)
+    ], batch_size=BATCH_SIZE)
+    WishlistItem.objects.bulk_create([
+        WishlistItem(user=user, product=product, position=position)
+        for user in user_rows
+        for position, product in enumerate(rng.sample(product_rows, min(wishlist_size, len(product_rows))))
+    ], batch_size=BATCH_SIZE)
+
+    saves = WishlistItem.objects.filter(product=OuterRef('pk')).values('product').annotate(n=Count('id')).values('n')
+    Product.objects.filter(slug__startswith=f'{PREFIX}-').update(wishlist_count=Coalesce(Subquery(saves), 0))
+    for name in ('products', 'categories', 'sizes', 'popularity'):
+        bump_generation(name)
+    transaction.on_commit(build_home_feed)
+    return {'categories': len(category_rows), 'products': len(product_rows), 'users': len(user_rows)}
+
+
+def build_scenarios(seed=0):
+    """Scenario name -> (method, paths, needs login), sampled from the
+    seeded dataset. Paths are requested in turn."""
+    rng = random.Random(seed)
+    products = list(Product.objects.filter(slug__startswith=f'{PREFIX}-').values_list('id', 'slug', 'name'))
+    categories = list(Category.objects.filter(slug__startswith=f'{PREFIX}-').values_list('slug', flat=True))
+    logins = list(
+        CustomUser.objects.filter(login__startswith=PREFIX, wishlist_items__isnull=False)
+        .distinct().values_list('login', flat=True)
+    )
+    if not (products and categories and logins):
+        raise ValueError("No benchmark dataset, run bench_seed first")
+    sample = rng.sample(products, min(20, len(products)))
+    owned = set(WishlistItem.objects.filter(user__login=logins[0]).values_list('product_id', flat=True))
+    unsaved = [product for product in products if product[0] not in owned]
+    return {
+        'catalog': ('get', ['/catalog/', '/catalog/?sort=popular', '/catalog/?sort=trending'], False),
+        'catalog_filtered': ('get', [
+            f'/catalog/{rng.choice(categories)}/?color={rng.choice(COLORS)}&size={rng.choice(SIZES)}&max_price=25000'
+            for _ in range(10)
+        ], False),
+        'catalog_search': ('get', [f'/catalog/?q={name.split()[1][:4]}' for _, _, name in sample], False),
+        'product_detail': ('get', [f'/product/{slug}' for _, slug, _ in sample], False),
+        'public_wishlist': ('get', [f'/users/{login}/' for login in rng.sample(logins, min(10, len(logins)))], False),
+        'add_to_wishlist': ('get', [
+            f'/users/{logins[0]}/add/{pk}/' for pk, _, _ in rng.sample(unsaved, min(20, len(unsaved)))
+        ], True),
+    }
+
+
+def _count_queries(counter):
+    def wrapper(execute, sql, params, many, context):
+        counter[0] += 1
+        return execute(sql, params, many, context)
+    return wrapper
+
+
+def _rss_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_client(method, paths, iterations, login=False, hx=True, warmup=5):
+    """Run a scenario in-process through the Django test client and
+    return ``summarize`` plus mean queries per request and peak RSS.
+    ``login`` scenarios are wishlist adds of the user in the first path;
+    each added product is removed again before the next request."""
+    client = Client(SERVER_NAME='localhost')
+    user = None
+    if login:
+        user = CustomUser.objects.get(login=re.match(r'/users/([^/]+)/', paths[0]).group(1))
+        client.force_login(user)
+    headers = {'HX-Request': 'true'} if hx else {}
+    urls = cycle(paths)
+    latencies, queries, errors = [], [], 0
+    for i in range(warmup + iterations):
+        counter = [0]
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(_count_queries(counter)))
+            url = next(urls)
+            started = time.perf_counter()
+            response = getattr(client, method)(url, headers=headers)
+            took = time.perf_counter() - started
+        if user is not None:
+            # Undo the add outside the timing, so every request adds the
+            # product instead of finding it already saved, and the dataset
+            # stays as seeded.
+            remove_products(user, [int(url.rstrip('/').rsplit('/', 1)[1])])
+        if i < warmup:
+            continue
+        if response.status_code < 400:
+            latencies.append(took)
+            queries.append(counter[0])
+        else:
+            errors += 1
+    summary = summarize(latencies, sum(latencies), errors)
+    summary['queries'] = statistics.fmean(queries) if queries else 0
+    summary['rss_mb'] = _rss_mb()
+    return summary
+
+
+def run_http(base_url, paths, iterations, hx=True, warmup=5):
+    """Run a scenario against a running server. Queries per request are
+    read from its Server-Timing header when SERVER_TIMING is on."""
+    session = requests.Session()
+    headers = {'HX-Request': 'true'} if hx else {}
+    urls = cycle(base_url.rstrip('/') + path for path in paths)
+    latencies, queries, errors = [], [], 0
+    for i in range(warmup + iterations):
+        started = time.perf_counter()
+        try:
+            response = session.get(next(urls), headers=headers, timeout=30)
+        except requests.RequestException:
+            response = None
+        took = time.perf_counter() - started
+        if i < warmup:
+            continue
+        if response is not None and response.status_code < 400:
+            latencies.append(took)
+            match = re.search(r'desc="(\d+) queries"', response.headers.get('Server-Timing', ''))
+            if match:
+                queries.append(int(match.group(1)))
+        else:
+            errors += 1
+    summary = summarize(latencies, sum(latencies), errors)
+    summary['queries'] = statistics.fmean(queries) if queries else None
+    summary['rss_mb'] = None
+    return summary
+
+
+def save_results(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Per scenario and metric, (current, baseline, change in percent,
+    regressed) for the latency percentiles and queries per request."""
+    rows = {}
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        rows[name] = {}
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'queries'):
+            now, before = current.get(metric), previous.get(metric)
+            if now is None or before is None:
+                continue
+            change = (now - before) / before * 100 if before else 0
+            regressed = now > before if metric == 'queries' else change > tolerance
+            rows[name][metric] = (now, before, change, regressed)
+    return rows
@@ -0,0 +1,177 @@
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from wishlist.db_router import acheck_replica_lag, check_replica_lag, record_write
+
+from .models import Category
+
+FRAGMENT_TIMEOUT = 60 * 15
+
+
+def _generation_key(name):
+    return f'gen:{name}'
+
+
+def _modified_key(name):
+    return f'modified:{name}'
+
+
+def get_generations(*names):
+    """Current generation counter for each name, in one cache round trip.
+
+    Missing counters start from the current time rather than 1 so that a
+    counter evicted from Redis never comes back at a value some stale
+    fragment was already keyed on. A request reading from the replica
+    moves to the primary if the replica has not caught up with the bumps.
+    """
+    keys = [_generation_key(name) for name in names]
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            cache.add(key, time.time_ns(), timeout=None)
+            values[key] = cache.get(key)
+    check_replica_lag()
+    return '.'.join(str(values[key]) for key in keys)
+
+
+async def aget_generations(*names):
+    keys = [_generation_key(name) for name in names]
+    values = await cache.aget_many(keys)
+    for key in keys:
+        if key not in values:
+            await cache.aadd(key, time.time_ns(), timeout=None)
+            values[key] = await cache.aget(key)
+    await acheck_replica_lag()
+    return '.'.join(str(values[key]) for key in keys)
+
+
+def _incr_generation(name):
+    key = _generation_key(name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+    cache.set(_modified_key(name), int(time.time()), timeout=None)
+
+
+def bump_generation(name):
+    record_write()
+    _incr_generation(name)
+
+
+def bump_generations_on_commit(*names):
+    """Bump ``names`` once the current transaction commits. Bumping
+    before it would let a concurrent request cache the old rows under
+    the new generation."""
+    def bump():
+        record_write()
+        for name in names:
+            _incr_generation(name)
+    transaction.on_commit(bump)
+
+
+def get_last_modified(*names):
+    """Time of the latest bump of any of ``names``. Unlike
+    ``max(updated_at)`` this also moves forward on deletes."""
+    values = cache.get_many([_modified_key(name) for name in names])
+    return max(values.values()) if values else None
+
+
+async def aget_last_modified(*names):
+    values = await cache.aget_many([_modified_key(name) for name in names])
+    return max(values.values()) if values else None
+
+
+def _etag(request, generations, user):
+    parts = [request.get_full_path(), bool(request.headers.get('HX-Request')), generations]
+    if user is not None:
+        parts.append(user.pk)
+    return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def get_validators(request, *names, per_user=True):
+    """ETag and Last-Modified for a page built from the ``names``
+    generations. HTMX fragments and full pages get different ETags; pages
+    that render per-user content also vary on the user."""
+    etag = _etag(request, get_generations(*names), request.user if per_user else None)
+    return etag, get_last_modified(*names)
+
+
+async def aget_validators(request, *names, per_user=True):
+    user = await request.auser() if per_user else None
+    etag = _etag(request, await aget_generations(*names), user)
+    return etag, await aget_last_modified(*names)
+
+
+def not_modified(request, etag, last_modified):
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    patch_vary_headers(response, ['HX-Request'])
+    return response
+
+
+def fragment_key(template, request, *parts):
+    params = sorted((key, value) for key, value in request.GET.lists() if any(value))
+    raw = repr((template, parts, params, bool(request.headers.get('HX-Request'))))
+    return f'fragment:{template}:{hashlib.md5(raw.encode()).hexdigest()}'
+
+
+def cached_fragment(request, template, get_context, *key_parts):
+    """Render ``template`` for an HTMX request, or serve the HTML cached
+    under ``key_parts`` and the normalized query string.
+
+    ``get_context`` is only called on a miss, so a hit skips the queries
+    as well as the rendering. Only use this for templates that do not
+    depend on the current user.
+    """
+    key = fragment_key(template, request, *key_parts)
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string(template, get_context(), request)
+        cache.set(key, html, FRAGMENT_TIMEOUT)
+    return HttpResponse(html)
+
+
+async def acached_fragment(request, template, aget_context, *key_parts):
+    """``cached_fragment`` for async views; ``aget_context`` is a coroutine
+    function and the template is rendered in a worker thread."""
+    key = fragment_key(template, request, *key_parts)
+    html = await cache.aget(key)
+    if html is None:
+        context = await aget_context()
+        html = await sync_to_async(render_to_string)(template, context, request)
+        await cache.aset(key, html, FRAGMENT_TIMEOUT)
+    return HttpResponse(html)
+
+
+def get_categories():
+    key = f'categories:{get_generations("categories")}'
+    categories = cache.get(key)
+    if categories is None:
+        categories = list(Category.objects.all())
+        cache.set(key, categories, FRAGMENT_TIMEOUT)
+    return categories
+
+
+async def aget_categories():
+    key = f'categories:{await aget_generations("categories")}'
+    categories = await cache.aget(key)
+    if categories is None:
+        categories = [category async for category in Category.objects.all()]
+        await cache.aset(key, categories, FRAGMENT_TIMEOUT)
+    return categories
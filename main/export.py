@@ -0,0 +1,148 @@
+"""Streaming catalog and wishlist exports.
+
+Rows come from ``.iterator(chunk_size=CHUNK_SIZE)``, i.e. a server-side
+cursor, and leave as CSV, JSONL or HTML text a chunk at a time, so an
+export holds one chunk in memory however many rows it has. The catalog
+CSV/JSONL columns are the ones main.importer reads.
+"""
+import csv
+import json
+from itertools import islice
+from urllib.parse import urljoin
+
+from asgiref.sync import sync_to_async
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.template.loader import get_template
+from django.urls import reverse
+
+from users.models import WishlistItem
+
+from .models import Product
+
+CHUNK_SIZE = 2000
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson',
+    'html': 'text/html; charset=utf-8',
+}
+CATALOG_COLUMNS = (
+    'id', 'name', 'slug', 'price', 'color', 'description', 'url', 'category',
+    'image_url', 'feed', 'wishlist_count', 'created_at',
+)
+WISHLIST_COLUMNS = (
+    'position', 'added_at', 'note', 'product_id', 'name', 'price', 'color', 'url', 'image_url', 'product_url',
+)
+WISHLIST_ORDERS = {
+    'newest': ('-added_at', '-id'),
+    'oldest': ('added_at', 'id'),
+    'position': ('position', 'id'),
+}
+
+
+def _image_url(name, base_url):
+    return urljoin(base_url, default_storage.url(name)) if name else ''
+
+
+def catalog_rows(base_url, feed_only=True):
+    """Yield a dict per product, in id order."""
+    products = Product.objects.order_by('id')
+    if feed_only:
+        products = products.filter(feed=True)
+    columns = [column for column in CATALOG_COLUMNS if column not in ('category', 'image_url')]
+    for row in products.values(*columns, 'category__name', 'main_image').iterator(chunk_size=CHUNK_SIZE):
+        row['category'] = row.pop('category__name') or ''
+        row['image_url'] = _image_url(row.pop('main_image'), base_url)
+        yield {column: row[column] for column in CATALOG_COLUMNS}
+
+
+def wishlist_rows(user, base_url, order='position'):
+    """Yield a dict per item of ``user``'s wishlist, in ``order`` as
+    ProfileProductsView shows it."""
+    items = (
+        WishlistItem.objects.filter(user=user).order_by(*WISHLIST_ORDERS[order])
+        .values('position', 'added_at', 'note', 'product_id', 'product__name', 'product__slug',
+                'product__price', 'product__color', 'product__url', 'product__main_image')
+    )
+    for row in items.iterator(chunk_size=CHUNK_SIZE):
+        yield {
+            'position': row['position'],
+            'added_at': row['added_at'],
+            'note': row['note'],
+            'product_id': row['product_id'],
+            'name': row['product__name'],
+            'price': row['product__price'],
+            'color': row['product__color'] or '',
+            'url': row['product__url'],
+            'image_url': _image_url(row['product__main_image'], base_url),
+            'product_url': urljoin(base_url, reverse('main:product_detail', args=[row['product__slug']])),
+        }
+
+
+def _chunks(rows, size=CHUNK_SIZE):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def to_csv(rows, columns):
+    writer = csv.DictWriter(_Echo(), columns)
+    yield writer.writeheader()
+    for chunk in _chunks(rows):
+        yield ''.join(writer.writerow(row) for row in chunk)
+
+
+def to_jsonl(rows):
+    for chunk in _chunks(rows):
+        yield ''.join(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n' for row in chunk)
+
+
+def to_html(rows, context):
+    """A standalone page: the head, the items a chunk at a time, the foot."""
+    yield get_template('users/export/snapshot_head.html').render(context)
+    items = get_template('users/export/snapshot_items.html')
+    for chunk in _chunks(rows):
+        yield items.render({'items': chunk})
+    yield get_template('users/export/snapshot_foot.html').render(context)
+
+
+def render(format, rows, columns, context=None):
+    """Text chunks of ``rows`` in ``format``."""
+    if format == 'csv':
+        return to_csv(rows, columns)
+    if format == 'jsonl':
+        return to_jsonl(rows)
+    if format == 'html':
+        return to_html(rows, context or {})
+    raise ValueError(f"Unknown export format {format!r}")
+
+
+async def _achunks(chunks):
+    """``chunks`` as an async iterator that produces one chunk per
+    sync_to_async call, on the thread that holds the cursor."""
+    chunks = iter(chunks)
+    next_chunk = sync_to_async(next)
+    while (chunk := await next_chunk(chunks, None)) is not None:
+        yield chunk
+
+
+def streaming_response(request, format, chunks, filename):
+    """Stream ``chunks``; CSV and JSONL download as ``filename``.<format>,
+    HTML opens in the browser.
+
+    Under ASGI Django would read a sync iterator into a list before
+    sending any of it, so there the chunks are pulled one at a time.
+    """
+    if isinstance(request, ASGIRequest):
+        chunks = _achunks(chunks)
+    response = StreamingHttpResponse(chunks, content_type=FORMATS[format])
+    if format != 'html':
+        response['Content-Disposition'] = f'attachment; filename="{filename}.{format}"'
+    return response
@@ -0,0 +1,112 @@
+from decimal import Decimal
+
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.db.models import BooleanField, ExpressionWrapper, Value
+
+# Upper bounds of the price histogram buckets; the last bucket is open-ended.
+PRICE_BUCKETS = [1000, 3000, 5000, 10000, 20000, 50000]
+
+# Facet dimensions, in the order their counts are selected.
+DIMENSIONS = ('colors', 'sizes', 'categories', 'prices')
+
+FACETS_SQL = """
+SELECT
+    GROUPING(p.color_key) AS by_color,
+    GROUPING(s.size_name) AS by_size,
+    GROUPING(c.id) AS by_category,
+    p.color_key,
+    s.size_name,
+    c.name,
+    c.slug,
+    p.bucket,
+    {counts}
+FROM (
+    SELECT
+        fp.id,
+        fp.category_id,
+        fp.sizes_in_stock,
+        {matches},
+        lower(trim(fp.color)) AS color_key,
+        width_bucket(fp.price, %s::numeric[]) AS bucket
+    FROM ({products}) fp
+) p
+LEFT JOIN LATERAL unnest(p.sizes_in_stock) AS s(size_name) ON true
+LEFT JOIN main_category c ON c.id = p.category_id
+GROUP BY GROUPING SETS (
+    (p.color_key),
+    (s.size_name),
+    (c.id, c.name, c.slug),
+    (p.bucket)
+)
+"""
+
+
+def _bucket_bounds(bucket):
+    low = PRICE_BUCKETS[bucket - 1] if bucket > 0 else 0
+    high = PRICE_BUCKETS[bucket] if bucket < len(PRICE_BUCKETS) else None
+    return low, high
+
+
+def _match_column(dimension):
+    return f'{dimension}_match'
+
+
+def compute_facets(queryset, filters=None):
+    """Per-colour, per-size, per-category counts and a price histogram for
+    the products in ``queryset``, all from one GROUPING SETS query.
+
+    ``filters`` maps facet dimensions to the Q the current filters apply
+    for them. Each dimension is counted with every filter but its own, so
+    picking a colour still lists the other colours with their counts.
+    """
+    filters = filters or {}
+    matches = {
+        _match_column(dimension): ExpressionWrapper(filters[dimension], output_field=BooleanField())
+        if dimension in filters else Value(True)
+        for dimension in DIMENSIONS
+    }
+    products = queryset.order_by().annotate(**matches).values(
+        'id', 'price', 'category_id', 'color', 'sizes_in_stock', *matches
+    )
+    try:
+        products_sql, params = products.query.sql_with_params()
+    except EmptyResultSet:
+        return {dimension: [] for dimension in DIMENSIONS}
+    counts = [
+        'COUNT(DISTINCT p.id) FILTER (WHERE {})'.format(
+            ' AND '.join(f'p.{_match_column(other)}' for other in DIMENSIONS if other != dimension)
+        )
+        for dimension in DIMENSIONS
+    ]
+    sql = FACETS_SQL.format(
+        products=products_sql,
+        counts=',\n    '.join(counts),
+        matches=',\n        '.join(f'fp.{column}' for column in matches),
+    )
+    bounds = [Decimal(bound) for bound in PRICE_BUCKETS]
+
+    facets = {dimension: [] for dimension in DIMENSIONS}
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, [bounds, *params])
+        rows = cursor.fetchall()
+
+    for by_color, by_size, by_category, color, size, category, slug, bucket, *counts in rows:
+        count = dict(zip(DIMENSIONS, counts))
+        if not by_color:
+            if color and count['colors']:
+                facets['colors'].append({'value': color, 'count': count['colors']})
+        elif not by_size:
+            if size and count['sizes']:
+                facets['sizes'].append({'value': size, 'count': count['sizes']})
+        elif not by_category:
+            if slug and count['categories']:
+                facets['categories'].append({'name': category, 'slug': slug, 'count': count['categories']})
+        elif bucket is not None and count['prices']:
+            low, high = _bucket_bounds(bucket)
+            facets['prices'].append({'min': low, 'max': high, 'count': count['prices']})
+
+    for key in ('colors', 'sizes', 'categories'):
+        facets[key].sort(key=lambda facet: -facet['count'])
+    facets['prices'].sort(key=lambda facet: facet['min'])
+    return facets
@@ -0,0 +1,49 @@
+from django.core.cache import cache
+from django.db.models import Sum
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+from .models import Category, Product
+
+FEED_KEY = 'home_feed'
+FEED_PRODUCTS = 24
+FEED_CATEGORIES = 8
+CARD_FIELDS = ('id', 'name', 'slug', 'color', 'price', 'main_image', 'thumbnail_widths')
+
+POPULARITY_WEIGHT = 1.0
+TRENDING_WEIGHT = 2.0
+RECENCY_WEIGHT = 3.0
+RECENCY_HALF_LIFE_HOURS = 72
+
+# Log scales keep one viral product from pushing the new ones off the feed.
+SCORE_SQL = """
+%s * ln(1 + wishlist_count) + %s * ln(1 + trending_score)
++ %s * power(0.5, extract(epoch FROM now() - created_at) / 3600 / %s)
+"""
+
+
+def build_home_feed():
+    """Rank feed-flagged products and categories and store the result
+    under FEED_KEY. Run by the rebuild_home_feed Beat task."""
+    score = RawSQL(SCORE_SQL, (POPULARITY_WEIGHT, TRENDING_WEIGHT, RECENCY_WEIGHT, RECENCY_HALF_LIFE_HOURS))
+    products = list(
+        Product.objects.filter(feed=True).only(*CARD_FIELDS)
+        .annotate(feed_score=score).order_by('-feed_score', '-id')[:FEED_PRODUCTS]
+    )
+    categories = list(
+        Category.objects.filter(feed=True)
+        .annotate(saves=Coalesce(Sum('products__wishlist_count'), 0))
+        .order_by('-saves', 'name')[:FEED_CATEGORIES]
+    )
+    feed = {'products': products, 'categories': categories}
+    cache.set(FEED_KEY, feed, timeout=None)
+    return feed
+
+
+def get_home_feed():
+    """The materialized feed: one cache read. Only rebuilt inline when
+    the key is missing, i.e. before the first Beat run or after eviction."""
+    feed = cache.get(FEED_KEY)
+    if feed is None:
+        feed = build_home_feed()
+    return feed
@@ -0,0 +1,77 @@
+import os
+from io import BytesIO
+
+import requests
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+THUMBNAIL_WIDTHS = (320, 640, 1024)
+THUMBNAIL_FORMAT = 'WEBP'
+THUMBNAIL_QUALITY = 80
+DOWNLOAD_TIMEOUT = 10
+MAX_DOWNLOAD_BYTES = 10 * 1024 * 1024
+
+
+def thumbnail_name(name, width):
+    root, _ = os.path.splitext(name)
+    return f'{root}_{width}.webp'
+
+
+def generate_thumbnails(name, storage=default_storage):
+    """Write a WebP copy of image ``name`` for every width in
+    THUMBNAIL_WIDTHS it is wider than, next to the original, and return
+    the widths written. An image no wider than the smallest width gets a
+    single copy at its own width."""
+    with storage.open(name) as original:
+        image = ImageOps.exif_transpose(Image.open(original))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    widths = [width for width in THUMBNAIL_WIDTHS if width < image.width] or [image.width]
+    for width in widths:
+        resized = image.copy()
+        resized.thumbnail((width, width * 10), Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        resized.save(buffer, THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY, method=4)
+        target = thumbnail_name(name, width)
+        if storage.exists(target):
+            storage.delete(target)
+        storage.save(target, ContentFile(buffer.getvalue()))
+    return widths
+
+
+def queue_thumbnails(instance):
+    """Forget the thumbnails of ``instance`` and rebuild them in Celery
+    once the current transaction has committed."""
+    from .tasks import generate_image_thumbnails
+
+    type(instance).objects.filter(pk=instance.pk).update(thumbnail_widths=[])
+    instance.thumbnail_widths = []
+    label = instance._meta.label_lower
+    transaction.on_commit(lambda: generate_image_thumbnails.delay(label, instance.pk))
+
+
+def download_image(url):
+    """Fetch the image at ``url`` into a ContentFile with an
+    ``image_format`` attribute ('jpeg', 'png'...). Raises ValueError for
+    anything that is not an image or is over MAX_DOWNLOAD_BYTES."""
+    with requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+        buffer = BytesIO()
+        for chunk in response.iter_content(64 * 1024):
+            buffer.write(chunk)
+            if buffer.tell() > MAX_DOWNLOAD_BYTES:
+                raise ValueError(f"image larger than {MAX_DOWNLOAD_BYTES} bytes")
+    try:
+        with Image.open(BytesIO(buffer.getvalue())) as image:
+            image.verify()
+            image_format = image.format.lower()
+    except Exception as e:
+        raise ValueError(f"not an image: {e}")
+    content = ContentFile(buffer.getvalue())
+    content.image_format = 'jpg' if image_format == 'jpeg' else image_format
+    return content
@@ -0,0 +1,204 @@
+"""Bulk product import from CSV or JSONL.
+
+Records are read one line at a time and written ``batch_size`` at a time
+with bulk_create, so memory stays bounded by the batch whatever the file
+size. Each batch resolves its categories through an in-memory cache, its
+slugs with a couple of queries, and commits on its own; the main image
+of each product is downloaded afterwards by the fetch_product_image task.
+
+Recognised columns: name, price (required), color, description, url,
+category, image_url and feed.
+"""
+import csv
+import io
+import json
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Q
+from slugify import slugify
+
+from .cache import bump_generation
+from .models import Category, Product
+
+BATCH_SIZE = 1000
+SLUG_LENGTH = Product._meta.get_field('slug').max_length
+# Room for a "-<n>" suffix on a truncated slug.
+SLUG_BASE_LENGTH = SLUG_LENGTH - 8
+MAX_ERRORS = 100
+PRICE_STEP = Decimal('0.01')
+MAX_PRICE = Decimal(10) ** 8
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+
+
+def read_records(stream, format):
+    """Yield (line number, dict) from a binary or text ``stream`` in
+    ``format`` 'csv' or 'jsonl', without reading it all at once."""
+    if isinstance(stream, io.TextIOBase):
+        text = stream
+    else:
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if format == 'csv':
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+    elif format == 'jsonl':
+        for number, line in enumerate(text, 1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except json.JSONDecodeError:
+                    yield number, None
+    else:
+        raise ValueError(f"Unknown import format {format!r}")
+
+
+def format_for(name):
+    return 'jsonl' if name.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def _text(record, field, strip=True):
+    """``record[field]`` as a string; JSON numbers are taken as written,
+    other non-string values are a ValueError for the row."""
+    value = record.get(field)
+    if value is None:
+        return ''
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = str(value)
+    if not isinstance(value, str):
+        raise ValueError(f"{field} must be a string, not {type(value).__name__}")
+    return value.strip() if strip else value
+
+
+class ProductImporter:
+    def __init__(self, batch_size=BATCH_SIZE, feed=False):
+        self.batch_size = batch_size
+        self.feed = feed
+        self.categories = {}
+        self.created = 0
+        self.errors = []
+
+    def run(self, records):
+        """Import ``(line, record)`` pairs and return (created, errors).
+        Batches commit on their own, so the caches are invalidated even
+        when a later batch fails."""
+        records = iter(records)
+        try:
+            while batch := list(islice(records, self.batch_size)):
+                self.import_batch(batch)
+        finally:
+            if self.created:
+                for name in ('products', 'categories', 'sizes'):
+                    bump_generation(name)
+        return self.created, self.errors
+
+    def error(self, line, message):
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(f"line {line}: {message}" if line else message)
+
+    @transaction.atomic
+    def import_batch(self, batch):
+        rows = []
+        for line, record in batch:
+            try:
+                rows.append(self.clean(record))
+            except ValueError as e:
+                self.error(line, e)
+        if not rows:
+            return
+        categories = self.resolve_categories({fields['category'] for fields in rows if fields['category']})
+        slugs = unique_slugs([fields['name'] for fields in rows])
+        products = []
+        for fields, slug in zip(rows, slugs):
+            image_url = fields.pop('image_url')
+            fields['category'] = categories.get(fields['category'])
+            products.append((Product(slug=slug, feed=fields.pop('feed', self.feed), **fields), image_url))
+        Product.objects.bulk_create([product for product, _ in products], batch_size=self.batch_size)
+        self.created += len(products)
+
+        downloads = [(product.pk, image_url) for product, image_url in products if image_url]
+        if downloads:
+            transaction.on_commit(lambda: queue_image_downloads(downloads))
+
+    def clean(self, record):
+        if record is None:
+            raise ValueError("invalid JSON")
+        if not isinstance(record, dict):
+            raise ValueError("not a JSON object")
+        name = _text(record, 'name')
+        if not name:
+            raise ValueError("name is required")
+        try:
+            price = Decimal(str(record.get('price', '')).strip()).quantize(PRICE_STEP)
+        except InvalidOperation:
+            raise ValueError(f"invalid price {record.get('price')!r}")
+        if not price.is_finite() or not 0 <= price < MAX_PRICE:
+            raise ValueError(f"price {price} out of range")
+        fields = {
+            'name': name[:100],
+            'price': price,
+            'color': _text(record, 'color')[:100] or None,
+            'description': _text(record, 'description', strip=False),
+            'url': _text(record, 'url')[:200],
+            'category': _text(record, 'category')[:100],
+            'image_url': _text(record, 'image_url'),
+        }
+        if record.get('feed') not in (None, ''):
+            fields['feed'] = str(record['feed']).strip().lower() in TRUE_VALUES
+        return fields
+
+    def resolve_categories(self, names):
+        """Category for each of ``names``, creating missing ones. Looked up
+        once per import; later batches hit self.categories."""
+        missing = names - self.categories.keys()
+        if missing:
+            for category in Category.objects.filter(name__in=missing).order_by('-id'):
+                self.categories[category.name] = category
+            new = [name for name in missing if name not in self.categories]
+            if new:
+                slugs = unique_slugs(new, model=Category)
+                for category in Category.objects.bulk_create(
+                    [Category(name=name, slug=slug) for name, slug in zip(new, slugs)]
+                ):
+                    self.categories[category.name] = category
+        return {name: self.categories[name] for name in names}
+
+
+def unique_slugs(names, model=Product):
+    """A slug for each of ``names`` that is unique among ``model`` rows and
+    within ``names``: the slugified name, or name-2, name-3... past the
+    highest suffix already taken. Two queries, whatever the batch size."""
+    bases = [slugify(name)[:SLUG_BASE_LENGTH].strip('-') or 'item' for name in names]
+    counts = Counter(bases)
+    taken = set(model.objects.filter(slug__in=counts.keys()).values_list('slug', flat=True))
+    colliding = [base for base in counts if base in taken or counts[base] > 1]
+
+    next_suffix = dict.fromkeys(colliding, 2)
+    if colliding:
+        prefixes = Q()
+        for base in colliding:
+            prefixes |= Q(slug__startswith=f'{base}-')
+        for slug in model.objects.filter(prefixes).values_list('slug', flat=True):
+            base, _, suffix = slug.rpartition('-')
+            if base in next_suffix and suffix.isdigit():
+                next_suffix[base] = max(next_suffix[base], int(suffix) + 1)
+
+    slugs = []
+    for base in bases:
+        slug = base
+        while slug in taken:
+            suffix = next_suffix.setdefault(base, 2)
+            slug = f'{base}-{suffix}'
+            next_suffix[base] = suffix + 1
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def queue_image_downloads(downloads):
+    from .tasks import fetch_product_image
+
+    for product_id, url in downloads:
+        fetch_product_image.delay(product_id, url)
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.benchmark import build_scenarios, compare, load_results, run_client, run_http, save_results
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the HTMX endpoint scenarios against the bench_seed dataset and "
+        "report p50/p95/p99 latency, queries per request and RSS. Runs "
+        "in-process through the test client unless --base-url is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help="Scenario to run, repeatable (default: all)")
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--base-url', help="Drive a running server over HTTP instead")
+        parser.add_argument('--full-page', action='store_true', help="Omit the HX-Request header")
+        parser.add_argument('--save-baseline', metavar='PATH', help="Write the results to PATH")
+        parser.add_argument('--baseline', metavar='PATH', help="Compare against results saved in PATH")
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help="Exit with an error when compare() flags a regression")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            scenarios = build_scenarios(options['seed'])
+        except ValueError as e:
+            raise CommandError(e)
+        names = options['scenarios'] or list(scenarios)
+        unknown = set(names) - set(scenarios)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        hx = not options['full_page']
+        results = {}
+        for name in names:
+            method, paths, login = scenarios[name]
+            if options['base_url']:
+                if login:
+                    self.stdout.write(f"{name:<18} skipped, needs a logged-in session")
+                    continue
+                result = run_http(options['base_url'], paths, options['iterations'], hx)
+            else:
+                result = run_client(method, paths, options['iterations'], login, hx)
+            results[name] = result
+            queries = 'n/a' if result['queries'] is None else f"{result['queries']:.1f}"
+            rss = '' if result['rss_mb'] is None else f", rss {result['rss_mb']:.0f} MB"
+            self.stdout.write(
+                f"{name:<18} p50 {result['p50_ms']:7.1f} ms  p95 {result['p95_ms']:7.1f} ms  "
+                f"p99 {result['p99_ms']:7.1f} ms  queries {queries}, errors {result['errors']}{rss}"
+            )
+
+        if options['save_baseline']:
+            save_results(options['save_baseline'], results)
+            self.stdout.write(self.style.SUCCESS(f"Saved baseline to {options['save_baseline']}"))
+
+        if options['baseline']:
+            regressions = 0
+            for name, metrics in compare(results, load_results(options['baseline'])).items():
+                for metric, (now, before, change, regressed) in metrics.items():
+                    line = f"{name:<18} {metric:<8} {before:8.1f} -> {now:8.1f} ({change:+.0f}%)"
+                    if regressed:
+                        regressions += 1
+                        line = self.style.ERROR(line)
+                    self.stdout.write(line)
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f"{regressions} metrics regressed against {options['baseline']}")
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from main.benchmark import drive_http
+
+DEFAULT_PATHS = ['/catalog/', '/catalog/?sort=popular']
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive concurrent HTMX GETs at a running server and report throughput "
+        "and latency. Run it once against each SERVER_PROFILE with the same "
+        "WEB_WORKERS to compare the WSGI and ASGI deployments."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://localhost:8000')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help="Path to request, repeatable (default: catalog pages)")
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--full-page', action='store_true', help="Omit the HX-Request header")
+
+    def handle(self, *args, **options):
+        headers = None if options['full_page'] else {'HX-Request': 'true'}
+        result = drive_http(
+            options['base_url'], options['paths'] or DEFAULT_PATHS,
+            options['requests'], options['concurrency'], headers,
+        )
+        self.stdout.write(
+            f"{result['requests']} ok, {result['errors']} errors, {result['rps']:.1f} req/s, "
+            f"p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms"
+        )
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from main.benchmark import clear_dataset, seed_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Replace the synthetic benchmark dataset (rows prefixed with 'bench') "
+        "with a fresh one for the bench command"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--images', type=int, default=3, help="Extra images per product")
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--wishlist-size', type=int, default=30)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--clear', action='store_true', help="Only delete the dataset")
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            clear_dataset()
+            self.stdout.write(self.style.SUCCESS("Deleted the benchmark dataset"))
+            return
+        created = seed_dataset(
+            options['categories'], options['products'], options['users'],
+            options['wishlist_size'], options['images'], options['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {created['categories']} categories, {created['products']} products "
+            f"and {created['users']} users"
+        ))
@@ -0,0 +1,45 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from main import export
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream the catalog, or one user's wishlist with --wishlist, as CSV, "
+        "JSONL or (wishlists only) a standalone HTML page"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(export.FORMATS), default='csv')
+        parser.add_argument('--output', default='-', help="File to write, '-' for stdout")
+        parser.add_argument('--wishlist', metavar='LOGIN', help="Export this user's wishlist")
+        parser.add_argument('--order', choices=list(export.WISHLIST_ORDERS), default='position')
+        parser.add_argument('--all', action='store_true', help="Include products that are not in the feed")
+
+    def handle(self, *args, **options):
+        format = options['format']
+        if options['wishlist']:
+            user = CustomUser.objects.filter(login=options['wishlist']).first()
+            if user is None:
+                raise CommandError(f"No user with login {options['wishlist']!r}")
+            rows = export.wishlist_rows(user, settings.SITE_URL, options['order'])
+            chunks = export.render(format, rows, export.WISHLIST_COLUMNS,
+                                   {'login': user.login, 'exported_at': timezone.now()})
+        elif format == 'html':
+            raise CommandError("HTML export is only available for wishlists")
+        else:
+            rows = export.catalog_rows(settings.SITE_URL, feed_only=not options['all'])
+            chunks = export.render(format, rows, export.CATALOG_COLUMNS)
+
+        output = sys.stdout if options['output'] == '-' else open(options['output'], 'w', encoding='utf-8', newline='')
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
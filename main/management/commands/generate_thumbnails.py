@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from main.models import Product, ProductImage
+from main.tasks import generate_image_thumbnails
+
+
+class Command(BaseCommand):
+    help = "Queue thumbnail generation for product images that have none yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Rebuild thumbnails for every image")
+
+    def handle(self, *args, **options):
+        queued = 0
+        for model, field in ((Product, 'main_image'), (ProductImage, 'image')):
+            images = model.objects.exclude(**{field: ''})
+            if not options['all']:
+                images = images.filter(thumbnail_widths=[])
+            for pk in images.values_list('pk', flat=True).iterator():
+                generate_image_thumbnails.delay(model._meta.label_lower, pk)
+                queued += 1
+        self.stdout.write(self.style.SUCCESS(f"Queued {queued} images"))
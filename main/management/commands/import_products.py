@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.importer import BATCH_SIZE, ProductImporter, format_for, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Import products from a CSV or JSONL file ('-' for stdin) in batches. "
+        "Main images given as image_url are downloaded by Celery afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Default: from the file extension")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--feed', action='store_true', help="Show imported products in the catalog")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or format_for(path)
+        importer = ProductImporter(options['batch_size'], options['feed'])
+        try:
+            stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        except OSError as e:
+            raise CommandError(e)
+        with stream:
+            created, errors = importer.run(read_records(stream, format))
+        for error in errors:
+            self.stderr.write(f"Skipped {error}")
+        self.stdout.write(self.style.SUCCESS(f"Imported {created} products"))
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-18 16:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_product_url_alter_product_color'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('feed', True)), fields=['-created_at', '-id'], name='product_feed_created_idx'),
+        ),
+    ]
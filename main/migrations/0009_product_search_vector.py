@@ -0,0 +1,90 @@
+# Generated by Django 5.2.3 on 2026-10-18 16:40
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+SEARCH_VECTOR_TRIGGER = """
+CREATE OR REPLACE FUNCTION main_product_search_vector() RETURNS trigger AS $$
+DECLARE
+    category_name text;
+BEGIN
+    SELECT name INTO category_name FROM main_category WHERE id = NEW.category_id;
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(category_name, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(category_name, '')), 'B') ||
+        setweight(to_tsvector('russian', coalesce(NEW.color, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(NEW.color, '')), 'B') ||
+        setweight(to_tsvector('russian', coalesce(NEW.description, '')), 'C') ||
+        setweight(to_tsvector('english', coalesce(NEW.description, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER main_product_search_vector_update
+    BEFORE INSERT OR UPDATE OF name, description, color, category_id, search_vector
+    ON main_product
+    FOR EACH ROW EXECUTE FUNCTION main_product_search_vector();
+
+CREATE OR REPLACE FUNCTION main_category_search_vector() RETURNS trigger AS $$
+BEGIN
+    UPDATE main_product SET search_vector = NULL WHERE category_id = NEW.id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER main_category_search_vector_update
+    AFTER UPDATE OF name ON main_category
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION main_category_search_vector();
+
+UPDATE main_product SET search_vector = NULL;
+"""
+
+DROP_SEARCH_VECTOR_TRIGGER = """
+DROP TRIGGER IF EXISTS main_category_search_vector_update ON main_category;
+DROP FUNCTION IF EXISTS main_category_search_vector();
+DROP TRIGGER IF EXISTS main_product_search_vector_update ON main_product;
+DROP FUNCTION IF EXISTS main_product_search_vector();
+"""
+
+
+def create_trigram_index(apps, schema_editor):
+    # pg_trgm ships with contrib; search falls back to icontains without it.
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS product_name_trgm_idx "
+            "ON main_product USING gin (name gin_trgm_ops)"
+        )
+
+
+def drop_trigram_index(apps, schema_editor):
+    schema_editor.execute("DROP INDEX IF EXISTS product_name_trgm_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_product_feed_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+        ),
+        migrations.RunSQL(SEARCH_VECTOR_TRIGGER, DROP_SEARCH_VECTOR_TRIGGER),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.3 on 2026-10-18 16:42
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+def backfill_sizes_in_stock(apps, schema_editor):
+    Product = apps.get_model('main', 'Product')
+    ProductSize = apps.get_model('main', 'ProductSize')
+    sizes = {}
+    in_stock = ProductSize.objects.filter(stock__gt=0, size__name__isnull=False)
+    for product_id, name in in_stock.values_list('product_id', 'size__name').iterator():
+        sizes.setdefault(product_id, set()).add(name)
+    for product_id, names in sizes.items():
+        Product.objects.filter(pk=product_id).update(sizes_in_stock=sorted(names))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sizes_in_stock',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=20), blank=True, default=list, editable=False, size=None),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['sizes_in_stock'], name='product_sizes_in_stock_idx'),
+        ),
+        migrations.RunPython(backfill_sizes_in_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.3 on 2026-10-18 16:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_thumbnail_widths'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('position', models.PositiveSmallIntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'price'], name='product_category_price_idx'),
+        ),
+        migrations.AddField(
+            model_name='productrecommendation',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='main.product'),
+        ),
+        migrations.AddField(
+            model_name='productrecommendation',
+            name='recommended',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_for', to='main.product'),
+        ),
+        migrations.AddConstraint(
+            model_name='productrecommendation',
+            constraint=models.UniqueConstraint(fields=('product', 'position'), name='unique_recommendation_position'),
+        ),
+    ]
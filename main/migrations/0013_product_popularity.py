@@ -0,0 +1,42 @@
+# Generated by Django 5.2.3 on 2026-10-18 16:51
+
+from django.db import migrations, models
+
+
+BACKFILL_WISHLIST_COUNT = """
+UPDATE main_product AS product
+SET wishlist_count = saved.count, trending_score = saved.count
+FROM (
+    SELECT product_id, COUNT(*) AS count FROM users_customuser_products GROUP BY product_id
+) AS saved
+WHERE product.id = saved.product_id
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_product_recommendation'),
+        ('users', '0004_customuser_login_customuser_products'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='wishlist_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('feed', True)), fields=['-wishlist_count', '-id'], name='product_feed_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('feed', True)), fields=['-trending_score', '-id'], name='product_feed_trending_idx'),
+        ),
+        migrations.RunSQL(BACKFILL_WISHLIST_COUNT, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.3 on 2026-10-18 16:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_product_popularity'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='url',
+            field=models.URLField(blank=True, default=''),
+            preserve_default=False,
+        ),
+    ]
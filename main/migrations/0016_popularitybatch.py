@@ -0,0 +1,20 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_alter_product_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PopularityBatch',
+            fields=[
+                ('id', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('flushed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -1,4 +1,7 @@
 from django.db import models
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
 from slugify import slugify
@@ -44,6 +47,37 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products', null=True, blank=True)
     url = models.URLField(max_length=200, blank=True)
     feed = models.BooleanField(default=False)
+    # Maintained by the main_product_search_vector trigger (migration 0009).
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Names of sizes with stock > 0, kept in sync by main.signals.
+    sizes_in_stock = ArrayField(models.CharField(max_length=20), default=list, blank=True, editable=False)
+    # Widths of the WebP thumbnails written next to main_image by main.tasks.
+    thumbnail_widths = ArrayField(models.PositiveIntegerField(), default=list, blank=True, editable=False)
+    # Buffered in Redis and written in batches by main.popularity.
+    wishlist_count = models.PositiveIntegerField(default=0, editable=False)
+    trending_score = models.FloatField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+            GinIndex(fields=['sizes_in_stock'], name='product_sizes_in_stock_idx'),
+            models.Index(fields=['category', 'price'], name='product_category_price_idx'),
+            models.Index(
+                fields=['-created_at', '-id'],
+                condition=models.Q(feed=True),
+                name='product_feed_created_idx',
+            ),
+            models.Index(
+                fields=['-wishlist_count', '-id'],
+                condition=models.Q(feed=True),
+                name='product_feed_popular_idx',
+            ),
+            models.Index(
+                fields=['-trending_score', '-id'],
+                condition=models.Q(feed=True),
+                name='product_feed_trending_idx',
+            ),
+        ]
 
     def clean(self):
         if self.url:
@@ -58,9 +92,37 @@ class Product(models.Model):
             self.slug = slugify(self.name)
         super().save(*args, **kwargs)   
 
+    def refresh_sizes_in_stock(self):
+        self.sizes_in_stock = list(
+            self.product_sizes.filter(stock__gt=0, size__name__isnull=False)
+            .order_by('size__name').values_list('size__name', flat=True).distinct()
+        )
+        Product.objects.filter(pk=self.pk).update(sizes_in_stock=self.sizes_in_stock)
+
     def __str__(self):
         return self.name
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete = models.CASCADE, related_name = 'images')
     image = models.ImageField(upload_to='products/extra/')
+    thumbnail_widths = ArrayField(models.PositiveIntegerField(), default=list, blank=True, editable=False)
+
+
+class ProductRecommendation(models.Model):
+    """Precomputed top-N "you may also like" list, rebuilt by main.tasks."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommended_for')
+    score = models.FloatField()
+    position = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'position'], name='unique_recommendation_position'),
+        ]
+
+
+class PopularityBatch(models.Model):
+    """A batch of main.popularity counters already written to Product,
+    so a flush retried after a crash does not apply it twice."""
+    id = models.CharField(max_length=32, primary_key=True)
+    flushed_at = models.DateTimeField(auto_now_add=True)
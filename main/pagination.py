@@ -0,0 +1,60 @@
+from datetime import datetime
+
+from django.db.models import Q
+
+
+class KeysetPaginator:
+    """Cursor pagination on (key, id), descending unless ``descending`` is
+    False.
+
+    The cursor is the key of the last row on the previous page, so every
+    page is an index range scan with a LIMIT no matter how deep it is.
+    ``key`` defaults to ``created_at``; search results page on ``rank``
+    with ``parse=float``.
+    """
+
+    def __init__(self, queryset, per_page, key='created_at', parse=datetime.fromisoformat, descending=True):
+        self.key = key
+        self.parse = parse
+        self.descending = descending
+        direction = '-' if descending else ''
+        self.queryset = queryset.order_by(f'{direction}{key}', f'{direction}id')
+        self.per_page = per_page
+
+    @staticmethod
+    def encode_cursor(value, pk):
+        value = value.isoformat() if isinstance(value, datetime) else repr(value)
+        return f"{value}_{pk}"
+
+    def decode_cursor(self, cursor):
+        value, _, pk = cursor.rpartition('_')
+        return self.parse(value), int(pk)
+
+    def _page_queryset(self, cursor):
+        queryset = self.queryset
+        if cursor:
+            try:
+                value, pk = self.decode_cursor(cursor)
+            except ValueError:
+                pass
+            else:
+                lookup = 'lt' if self.descending else 'gt'
+                queryset = queryset.filter(
+                    Q(**{f'{self.key}__{lookup}': value}) |
+                    Q(**{self.key: value, f'id__{lookup}': pk})
+                )
+        return queryset[:self.per_page + 1]
+
+    def _split(self, items):
+        next_cursor = None
+        if len(items) > self.per_page:
+            items = items[:self.per_page]
+            last = items[-1]
+            next_cursor = self.encode_cursor(getattr(last, self.key), last.pk)
+        return items, next_cursor
+
+    def get_page(self, cursor=None):
+        return self._split(list(self._page_queryset(cursor)))
+
+    async def aget_page(self, cursor=None):
+        return self._split([item async for item in self._page_queryset(cursor)])
@@ -0,0 +1,125 @@
+"""Wishlist popularity counters.
+
+Saves and removals are added up in a Redis hash and written to
+Product.wishlist_count and Product.trending_score by ``flush`` in one
+UPDATE per batch, so a product saved by many users at once costs one row
+update a minute instead of one locked update per click.
+"""
+import uuid
+from collections import Counter
+from datetime import timedelta
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+from django.db import connection, transaction
+
+from .cache import bump_generation
+from .models import PopularityBatch
+
+PENDING_KEY = 'popularity:pending'
+FLUSHING_KEY = 'popularity:flushing'
+# Hash field of FLUSHING_KEY holding the id of the batch.
+BATCH_FIELD = 'batch'
+BATCH_RETENTION = timedelta(days=7)
+
+TRENDING_HALF_LIFE_HOURS = 24
+DECAY_INTERVAL_HOURS = 1
+# Decayed scores below this drop to 0 so decay stops rewriting the row.
+TRENDING_FLOOR = 0.01
+
+FLUSH_SQL = """
+UPDATE main_product AS product
+SET wishlist_count = GREATEST(product.wishlist_count + pending.delta, 0),
+    trending_score = GREATEST(product.trending_score + pending.delta, 0)
+FROM unnest(%(product_ids)s::bigint[], %(deltas)s::integer[]) AS pending(id, delta)
+WHERE product.id = pending.id
+"""
+
+# Records the batch as applied, or nothing if it already was; ids older
+# than ``keep`` can no longer come back and are dropped on the way.
+BATCH_SQL = f"""
+WITH pruned AS (
+    DELETE FROM {PopularityBatch._meta.db_table} WHERE flushed_at < now() - %(keep)s
+)
+INSERT INTO {PopularityBatch._meta.db_table} (id, flushed_at) VALUES (%(batch_id)s, now())
+ON CONFLICT (id) DO NOTHING
+"""
+
+DECAY_SQL = """
+UPDATE main_product
+SET trending_score = CASE WHEN trending_score * %(factor)s < %(floor)s THEN 0
+                          ELSE trending_score * %(factor)s END
+WHERE trending_score > 0
+"""
+
+
+@lru_cache(maxsize=None)
+def get_client():
+    return redis.Redis.from_url(settings.POPULARITY_REDIS_URL)
+
+
+def record(deltas):
+    """Add ``{product_id: delta}`` to the pending batch."""
+    deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    pipeline = get_client().pipeline(transaction=False)
+    for product_id, delta in deltas.items():
+        pipeline.hincrby(PENDING_KEY, product_id, delta)
+    pipeline.execute()
+
+
+def record_on_commit(product_ids, delta):
+    """Count ``delta`` for each of ``product_ids``, once per occurrence,
+    once the wishlist write commits. A Redis outage loses the increments,
+    not the request."""
+    deltas = Counter()
+    for product_id in product_ids:
+        deltas[product_id] += delta
+    deltas = dict(deltas)
+    if deltas:
+        transaction.on_commit(lambda: record(deltas), robust=True)
+
+
+def flush():
+    """Write the pending batch to Postgres and return the number of
+    products updated."""
+    client = get_client()
+    # A flush that died after the rename left its batch behind; finish
+    # that one first, new increments keep going to PENDING_KEY meanwhile.
+    if not client.exists(FLUSHING_KEY):
+        try:
+            client.rename(PENDING_KEY, FLUSHING_KEY)
+        except redis.ResponseError:
+            return 0
+    # Name the batch once; a retry reads the same id back. The id commits
+    # with the UPDATE, so a batch whose UPDATE committed before the crash
+    # is only deleted, not applied again.
+    client.hsetnx(FLUSHING_KEY, BATCH_FIELD, uuid.uuid4().hex)
+    fields = client.hgetall(FLUSHING_KEY)
+    batch_id = fields.pop(BATCH_FIELD.encode()).decode()
+    batch = sorted((int(product_id), int(delta)) for product_id, delta in fields.items())
+    batch = [(product_id, delta) for product_id, delta in batch if delta]
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(BATCH_SQL, {'batch_id': batch_id, 'keep': BATCH_RETENTION})
+        applied = cursor.rowcount == 1
+        if applied and batch:
+            product_ids, deltas = zip(*batch)
+            cursor.execute(FLUSH_SQL, {'product_ids': list(product_ids), 'deltas': list(deltas)})
+    if applied and batch:
+        bump_generation('popularity')
+    client.delete(FLUSHING_KEY)
+    return len(batch) if applied else 0
+
+
+def decay():
+    """Age trending scores by one DECAY_INTERVAL_HOURS step."""
+    factor = 0.5 ** (DECAY_INTERVAL_HOURS / TRENDING_HALF_LIFE_HOURS)
+    with connection.cursor() as cursor:
+        cursor.execute(DECAY_SQL, {'factor': factor, 'floor': TRENDING_FLOOR})
+        updated = cursor.rowcount
+    if updated:
+        bump_generation('popularity')
+    return updated
@@ -0,0 +1,134 @@
+from django.apps import apps
+from django.db import connection, transaction
+
+from .cache import bump_generations_on_commit
+from .models import ProductRecommendation
+
+TOP_N = 8
+# First key of the pg_advisory_xact_lock(int, int) taken per product.
+LOCK_NAMESPACE = 0x7265
+# Nearest-priced products taken from the same category on each side of the price.
+PRICE_NEIGHBOURS = 10
+WISHLIST_WEIGHT = 0.7
+SIMILARITY_WEIGHT = 0.3
+
+RECOMMENDATIONS_SQL = """
+WITH wishlist AS NOT MATERIALIZED (
+    SELECT {user_column} AS user_id, {product_column} AS product_id FROM {wishlist_table}
+),
+sources AS (
+    SELECT id, category_id, price FROM main_product {source_filter}
+),
+pairs AS (
+    SELECT a.product_id AS source_id, b.product_id AS target_id, COUNT(*) AS together
+    FROM wishlist a
+    JOIN sources s ON s.id = a.product_id
+    JOIN wishlist b ON b.user_id = a.user_id AND b.product_id <> a.product_id
+    GROUP BY a.product_id, b.product_id
+),
+-- Saves of the products the pairs reach only, so rebuilding a few
+-- products does not count the whole wishlist table.
+popularity AS (
+    SELECT product_id, COUNT(*) AS saves FROM wishlist
+    WHERE product_id IN (SELECT source_id FROM pairs UNION SELECT target_id FROM pairs)
+    GROUP BY product_id
+),
+co_saved AS (
+    SELECT source_id, target_id, together / sqrt(pa.saves * pb.saves) AS score
+    FROM pairs
+    JOIN popularity pa ON pa.product_id = pairs.source_id
+    JOIN popularity pb ON pb.product_id = pairs.target_id
+),
+same_category AS (
+    SELECT s.id AS source_id, n.id AS target_id,
+           1 - abs(n.price - s.price) / greatest(n.price, s.price, 1) AS score
+    FROM sources s
+    CROSS JOIN LATERAL (
+        (SELECT id, price FROM main_product
+         WHERE category_id = s.category_id AND feed AND price >= s.price AND id <> s.id
+         ORDER BY price LIMIT %(neighbours)s)
+        UNION ALL
+        (SELECT id, price FROM main_product
+         WHERE category_id = s.category_id AND feed AND price < s.price
+         ORDER BY price DESC LIMIT %(neighbours)s)
+    ) n
+),
+scored AS (
+    SELECT source_id, target_id, SUM(score) AS score FROM (
+        SELECT source_id, target_id, score * %(wishlist_weight)s AS score FROM co_saved
+        UNION ALL
+        SELECT source_id, target_id, score * %(similarity_weight)s FROM same_category
+    ) candidates
+    JOIN main_product target ON target.id = candidates.target_id AND target.feed
+    GROUP BY source_id, target_id
+),
+ranked AS (
+    SELECT source_id, target_id, score,
+           row_number() OVER (PARTITION BY source_id ORDER BY score DESC, target_id DESC) AS position
+    FROM scored
+)
+INSERT INTO {recommendation_table} (product_id, recommended_id, score, position)
+SELECT source_id, target_id, score, position FROM ranked WHERE position <= %(top_n)s
+"""
+
+
+def _build(product_ids=None):
+    field = apps.get_model('users', 'CustomUser')._meta.get_field('products')
+    params = {
+        'neighbours': PRICE_NEIGHBOURS,
+        'wishlist_weight': WISHLIST_WEIGHT,
+        'similarity_weight': SIMILARITY_WEIGHT,
+        'top_n': TOP_N,
+    }
+    source_filter = ''
+    if product_ids is not None:
+        source_filter = 'WHERE id = ANY(%(product_ids)s)'
+        params['product_ids'] = list(product_ids)
+    sql = RECOMMENDATIONS_SQL.format(
+        wishlist_table=field.remote_field.through._meta.db_table,
+        user_column=field.m2m_column_name(),
+        product_column=field.m2m_reverse_name(),
+        recommendation_table=ProductRecommendation._meta.db_table,
+        source_filter=source_filter,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _lock_table():
+    """Block rebuild_for until this transaction ends; readers still go through."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {ProductRecommendation._meta.db_table} IN EXCLUSIVE MODE')
+
+
+def _lock_products(product_ids):
+    """Serialize rebuilds of the same product until this transaction ends.
+    Ids are bigint, so the int4 lock key is a hash of the id; a collision
+    only serializes two unrelated rebuilds. Keys are locked in order so
+    overlapping rebuilds cannot deadlock."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_advisory_xact_lock(%s, key) FROM ('
+            'SELECT DISTINCT hashtext(id::text) AS key FROM unnest(%s::bigint[]) AS id ORDER BY 1'
+            ') keys',
+            [LOCK_NAMESPACE, product_ids],
+        )
+
+
+@transaction.atomic
+def rebuild_all():
+    """Recompute the top-N table for every product."""
+    _lock_table()
+    ProductRecommendation.objects.all().delete()
+    _build()
+    bump_generations_on_commit('recommendations')
+
+
+@transaction.atomic
+def rebuild_for(product_ids):
+    """Recompute the top-N rows of ``product_ids`` only."""
+    product_ids = sorted(set(product_ids))
+    _lock_products(product_ids)
+    ProductRecommendation.objects.filter(product_id__in=product_ids).delete()
+    _build(product_ids)
+    bump_generations_on_commit(*(f'product:{product_id}' for product_id in product_ids))
@@ -0,0 +1,59 @@
+import re
+from functools import lru_cache
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import F, Q, Value, FloatField
+from django.db.models.functions import Cast
+
+SEARCH_CONFIGS = ('russian', 'english')
+
+
+@lru_cache(maxsize=None)
+def trigram_enabled():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def build_query(text):
+    """Prefix tsquery over every word, OR-ed across the configs so that
+    partially typed words from the search box still match."""
+    terms = re.findall(r'\w+', text)
+    if not terms:
+        return None
+    raw = ' & '.join(f'{term}:*' for term in terms)
+    query = None
+    for config in SEARCH_CONFIGS:
+        part = SearchQuery(raw, config=config, search_type='raw')
+        query = part if query is None else query | part
+    return query
+
+
+def search_products(queryset, text, fuzzy=False):
+    """Filter ``queryset`` by ``text`` and annotate a ``rank`` to order by.
+
+    Matches full-text on the maintained ``search_vector``; with ``fuzzy``,
+    on trigram similarity of the name instead, so that typos still find
+    something. Callers run the fuzzy search when the full-text page comes
+    back empty rather than probing for matches first. Ranks are cast to
+    double precision so the value in a pagination cursor compares equal to
+    the one in the database.
+    """
+    query = build_query(text)
+    if query is None:
+        return queryset.annotate(rank=Value(0.0, output_field=FloatField())).none()
+
+    if not fuzzy:
+        return queryset.filter(search_vector=query).annotate(
+            rank=Cast(SearchRank(F('search_vector'), query), FloatField())
+        )
+
+    if trigram_enabled():
+        return queryset.filter(name__trigram_word_similar=text).annotate(
+            rank=Cast(TrigramWordSimilarity(text, 'name'), FloatField())
+        )
+
+    return queryset.filter(
+        Q(name__icontains=text) | Q(description__icontains=text)
+    ).annotate(rank=Value(0.0, output_field=FloatField()))
@@ -0,0 +1,48 @@
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from .cache import bump_generations_on_commit
+from .models import Category, Product, ProductImage, ProductRecommendation, ProductSize, Size
+
+
+@receiver(post_save, sender=ProductSize)
+@receiver(post_delete, sender=ProductSize)
+def sync_product_sizes(sender, instance, **kwargs):
+    Product(pk=instance.product_id).refresh_sizes_in_stock()
+
+
+@receiver(post_save, sender=Size)
+def sync_renamed_size(sender, instance, created, **kwargs):
+    if created:
+        return
+    for product in Product.objects.filter(product_sizes__size=instance).distinct():
+        product.refresh_sizes_in_stock()
+    bump_generations_on_commit('sizes')
+
+
+def _recommending(product_id):
+    """Generation names of the products whose related cards show
+    ``product_id``."""
+    rows = ProductRecommendation.objects.filter(recommended_id=product_id).values_list('product_id', flat=True)
+    return [f'product:{pk}' for pk in rows]
+
+
+# pre_delete, not post_delete: the recommendation rows are gone by then.
+@receiver(post_save, sender=Product)
+@receiver(pre_delete, sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    bump_generations_on_commit('products', f'product:{instance.pk}', *_recommending(instance.pk))
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductSize)
+@receiver(post_delete, sender=ProductSize)
+def invalidate_product_part(sender, instance, **kwargs):
+    bump_generations_on_commit('products', f'product:{instance.product_id}')
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    bump_generations_on_commit('categories')
@@ -0,0 +1,138 @@
+from datetime import timedelta
+
+from celery import shared_task
+from django.apps import apps
+from django.conf import settings
+from django.utils import timezone
+import logging
+import requests
+
+from .cache import bump_generation
+from .images import download_image, generate_thumbnails
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FIELDS = {
+    'main.product': 'main_image',
+    'main.productimage': 'image',
+}
+
+
+@shared_task
+def generate_image_thumbnails(model_label, pk):
+    model = apps.get_model(model_label)
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None:
+        return
+    image = getattr(instance, IMAGE_FIELDS[model_label])
+    if not image:
+        return
+    try:
+        widths = generate_thumbnails(image.name)
+    except Exception as e:
+        logger.error(f"Failed to generate thumbnails for {image.name}: {str(e)}")
+        raise
+    model.objects.filter(pk=pk, **{IMAGE_FIELDS[model_label]: image.name}).update(thumbnail_widths=widths)
+    product_id = instance.pk if model_label == 'main.product' else instance.product_id
+    bump_generation('products')
+    bump_generation(f'product:{product_id}')
+    logger.info(f"Generated {len(widths)} thumbnails for {image.name}")
+
+
+@shared_task(autoretry_for=(requests.ConnectionError, requests.Timeout), retry_backoff=True, max_retries=3)
+def fetch_product_image(product_id, url):
+    """Download the main image of an imported product, then generate its
+    thumbnails."""
+    from .models import Product
+
+    product = Product.objects.filter(pk=product_id).only('id', 'slug', 'main_image').first()
+    if product is None or product.main_image:
+        return
+    try:
+        content = download_image(url)
+    except (requests.HTTPError, ValueError) as e:
+        logger.error(f"Failed to fetch image {url} for product {product_id}: {str(e)}")
+        return
+    product.main_image.save(f'{product.slug}.{content.image_format}', content, save=False)
+    Product.objects.filter(pk=product_id).update(main_image=product.main_image.name)
+    generate_image_thumbnails('main.product', product_id)
+
+
+@shared_task
+def import_products_file(name, format=None, batch_size=None, feed=False):
+    """Import an uploaded CSV/JSONL file from default storage, then
+    delete it."""
+    from django.core.files.storage import default_storage
+    from .importer import BATCH_SIZE, ProductImporter, format_for, read_records
+
+    importer = ProductImporter(batch_size or BATCH_SIZE, feed)
+    try:
+        with default_storage.open(name, 'rb') as f:
+            created, errors = importer.run(read_records(f, format or format_for(name)))
+    finally:
+        default_storage.delete(name)
+    for error in errors:
+        logger.warning(f"Skipped product in {name}: {error}")
+    logger.info(f"Imported {created} products from {name}")
+
+
+@shared_task
+def rebuild_recommendations():
+    from .recommendations import rebuild_all
+
+    rebuild_all()
+    logger.info("Rebuilt product recommendations")
+
+
+@shared_task
+def refresh_recommendations(user_ids, product_ids):
+    """Recompute recommendations after ``user_ids`` added or removed
+    ``product_ids``: those products and the rest of their wishlists."""
+    from .recommendations import rebuild_for
+    from users.models import WishlistItem
+
+    wishlist = WishlistItem.objects.filter(user_id__in=user_ids)
+    affected = set(product_ids) | set(wishlist.values_list('product_id', flat=True))
+    rebuild_for(affected)
+
+
+@shared_task
+def flush_popularity():
+    from .popularity import flush
+
+    updated = flush()
+    if updated:
+        logger.info(f"Flushed popularity counters for {updated} products")
+
+
+@shared_task
+def decay_trending():
+    from .popularity import decay
+
+    decay()
+
+
+@shared_task
+def rebuild_home_feed():
+    from .feed import build_home_feed
+
+    feed = build_home_feed()
+    logger.info(f"Rebuilt home feed with {len(feed['products'])} products")
+
+
+@shared_task
+def prune_task_results(batch_size=1000):
+    """Delete django-db task results older than TASK_RESULT_RETENTION_DAYS,
+    in batches so the deletes never hold long locks."""
+    from django_celery_results.models import TaskResult
+
+    cutoff = timezone.now() - timedelta(days=settings.TASK_RESULT_RETENTION_DAYS)
+    expired = TaskResult.objects.filter(date_done__lt=cutoff)
+    deleted = 0
+    while True:
+        ids = list(expired.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        deleted += TaskResult.objects.filter(id__in=ids).delete()[0]
+    if deleted:
+        logger.info(f"Pruned {deleted} task results")
@@ -0,0 +1,16 @@
+from django import template
+
+from main.images import thumbnail_name
+
+register = template.Library()
+
+
+@register.filter
+def srcset(image):
+    """``srcset`` value for an ImageField file whose instance has
+    ``thumbnail_widths``, or an empty string while they are not built."""
+    if not image:
+        return ''
+    widths = getattr(image.instance, 'thumbnail_widths', None) or []
+    return ', '.join(f'{image.storage.url(thumbnail_name(image.name, width))} {width}w' for width in widths)
+
@@ -1,3 +1,821 @@
-from django.test import TestCase
+import json
+import tempfile
+import threading
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import redis
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import InMemoryStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.cache.backends import locmem
+from django.core.signals import request_finished, request_started
+from django.db import connection, router, transaction
+from django.db.models import Q
+from django.http import HttpResponse
+from django.utils import timezone
+from django.test import (
+    AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from PIL import Image
+
+from wishlist.db_router import PIN_COOKIE, REPLICA, WAL_POSITION_KEY, ReplicaMiddleware, record_write, replica_reads
+from wishlist.instrumentation import CacheMetricsMixin, QueryBudgetExceeded, RequestMetricsMiddleware, query_budget
+
+from users.models import CustomUser, WishlistItem
+from users.views import AsyncProfileProductsView, ProfileProductsView
+
+from . import export, popularity
+from .cache import aget_generations, bump_generation, get_generations
+from .facets import compute_facets
+from .images import generate_thumbnails, thumbnail_name
+from .importer import ProductImporter, read_records
+from .models import Category, Product, ProductImage, ProductRecommendation, ProductSize, Size
+from .pagination import KeysetPaginator
+from .recommendations import rebuild_all, rebuild_for
+from .search import search_products, trigram_enabled
+from .tasks import import_products_file
+from .views import AsyncCatalogView, AsyncProductDetailView, CatalogView, ProductDetailView
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProductDetailViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shoes')
+        cls.product = Product.objects.create(name='Sneakers', price=100, category=category, main_image='p.jpg')
+        for name in ('S', 'M', 'L'):
+            ProductSize.objects.create(product=cls.product, size=Size.objects.create(name=name), stock=1)
+        for _ in range(3):
+            ProductImage.objects.create(product=cls.product, image='extra.jpg')
+
+    def setUp(self):
+        cache.clear()
+        # A test replica is a separate connection that cannot see this
+        # test's uncommitted data, so read from the primary like a
+        # browser that has just written.
+        self.client.cookies[PIN_COOKIE] = '1'
+
+    def get(self):
+        return self.client.get(f'/product/{self.product.slug}', HTTP_HX_REQUEST='true')
+
+    def test_query_count_is_constant(self):
+        # The product with its category, the category list, images, sizes
+        # with their size, and recommendations. No request transaction.
+        with self.assertNumQueries(5):
+            response = self.get()
+        self.assertContains(response, 'SHOES')
+        self.assertContains(response, 'data-size="L"')
+
+    def test_cached_fragments_skip_images_and_sizes(self):
+        self.get()
+        with self.assertNumQueries(1):
+            self.get()
+
+
+class ConnectionReuseTests(TransactionTestCase):
+    def connects_for_requests(self, max_age, requests=3):
+        """Number of new database connections over ``requests`` simulated
+        request cycles with CONN_MAX_AGE set to ``max_age``."""
+        connection.close()
+        with mock.patch.dict(connection.settings_dict, CONN_MAX_AGE=max_age), \
+                mock.patch.object(connection, 'connect', wraps=connection.connect) as connect:
+            for _ in range(requests):
+                request_started.send(sender=self.__class__)
+                Product.objects.exists()
+                request_finished.send(sender=self.__class__)
+        connection.close()
+        return connect.call_count
+
+    def test_persistent_connection_is_reused_across_requests(self):
+        self.assertEqual(self.connects_for_requests(max_age=0), 3)
+        self.assertEqual(self.connects_for_requests(max_age=60), 1)
+
+
+def reading_view(request):
+    return HttpResponse(router.db_for_read(Product))
+
+
+@replica_reads
+def replica_view(request):
+    return reading_view(request)
+
+
+def writing_view(request):
+    return HttpResponse(router.db_for_write(Product))
+
+
+@mock.patch.dict(settings.DATABASES, {REPLICA: {}})
+class ReplicaRoutingTests(SimpleTestCase):
+    def dispatch(self, view, cookies=None):
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies or {})
+        middleware = ReplicaMiddleware(lambda request: middleware.process_view(request, view, (), {}) or view(request))
+        return middleware(request)
+
+    def test_marked_views_read_from_replica(self):
+        self.assertEqual(self.dispatch(replica_view).content, b'replica')
+        self.assertEqual(self.dispatch(reading_view).content, b'default')
+
+    def test_write_pins_browser_to_primary(self):
+        response = self.dispatch(writing_view)
+        self.assertEqual(response.content, b'default')
+        self.assertIn(PIN_COOKIE, response.cookies)
+        pinned = self.dispatch(replica_view, cookies={PIN_COOKIE: '1'})
+        self.assertEqual(pinned.content, b'default')
+        self.assertNotIn(PIN_COOKIE, pinned.cookies)
+
+
+@replica_reads
+def generation_view(request):
+    get_generations('products')
+    return reading_view(request)
+
+
+@replica_reads
+async def async_generation_view(request):
+    await aget_generations('products')
+    return HttpResponse(router.db_for_read(Product))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+@mock.patch.dict(settings.DATABASES, {REPLICA: {}})
+class ReplicaLagTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        # WAL positions of a primary at 200 and a replica stuck at 100.
+        patches = {
+            'primary': mock.patch('wishlist.db_router._primary_position', return_value=200),
+            'replica': mock.patch('wishlist.db_router._replica_position', return_value=100),
+            'replayed': mock.patch('wishlist.db_router._replayed', 0),
+        }
+        for name, patch in patches.items():
+            setattr(self, name, patch.start())
+            self.addCleanup(patch.stop)
+
+    def dispatch(self, view):
+        middleware = ReplicaMiddleware(lambda request: middleware.process_view(request, view, (), {}) or view(request))
+        return middleware(RequestFactory().get('/'))
+
+    async def adispatch(self, view):
+        async def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return await view(request)
+        middleware = ReplicaMiddleware(get_response)
+        return await middleware(AsyncRequestFactory().get('/'))
+
+    def test_lagging_replica_does_not_render_a_newer_generation(self):
+        bump_generation('products')
+        self.assertEqual(self.dispatch(generation_view).content, b'default')
+        self.replica.return_value = 200
+        self.assertEqual(self.dispatch(generation_view).content, b'replica')
+        self.primary.return_value = 300
+        bump_generation('products')
+        self.assertEqual(self.dispatch(generation_view).content, b'default')
+
+    async def test_async_lagging_replica_does_not_render_a_newer_generation(self):
+        await sync_to_async(bump_generation)('products')
+        self.assertEqual((await self.adispatch(async_generation_view)).content, b'default')
+        self.replica.return_value = 200
+        self.assertEqual((await self.adispatch(async_generation_view)).content, b'replica')
+
+    def test_recorded_position_only_moves_forward(self):
+        record_write()
+        self.primary.return_value = 150
+        record_write()
+        self.assertEqual(cache.get(WAL_POSITION_KEY), 200)
+        self.primary.return_value = 250
+        record_write()
+        self.assertEqual(cache.get(WAL_POSITION_KEY), 250)
+
+
+class LocMemCache(CacheMetricsMixin, locmem.LocMemCache):
+    pass
+
+
+@query_budget(1)
+def counting_view(request):
+    cache.get_many(['a', 'b'])
+    return HttpResponse(Product.objects.count() + Product.objects.count())
+
+
+@override_settings(
+    SERVER_TIMING=True,
+    CACHES={'default': {'BACKEND': 'main.tests.LocMemCache'}},
+)
+class RequestMetricsTests(TestCase):
+    def dispatch(self, view):
+        middleware = RequestMetricsMiddleware(lambda request: middleware.process_view(request, view, (), {}) or view(request))
+        return middleware(RequestFactory().get('/'))
+
+    def test_server_timing_reports_queries_and_cache(self):
+        cache.set('a', 1)
+        with self.settings(QUERY_BUDGET_RAISE=False), self.assertLogs('wishlist.requests', 'INFO') as logs:
+            response = self.dispatch(counting_view)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+        self.assertIn('cache;desc="1 hits, 1 misses"', response['Server-Timing'])
+        self.assertIn('over its budget of 1', logs.output[-1])
+
+    def test_view_over_budget_fails_under_tests(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.dispatch(counting_view)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shoes')
+        cls.product = Product.objects.create(name='Sneakers', price=100, category=category, main_image='p.jpg', feed=True)
+        owner = CustomUser.objects.create_user('a@example.com', 'ann', 'Ann', 'A', access=True)
+        WishlistItem.objects.create(user=owner, product=cls.product)
+
+    def setUp(self):
+        cache.clear()
+
+    def request(self, factory, path):
+        request = factory.get(path, headers={'HX-Request': 'true'})
+        request.user = AnonymousUser()
+
+        async def auser():
+            return request.user
+        request.auser = auser
+        return request
+
+    def render_sync(self, view_class, path, kwargs):
+        response = view_class.as_view()(self.request(RequestFactory(), path), **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response.content
+
+    async def render_async(self, view_class, path, kwargs):
+        response = await view_class.as_view()(self.request(AsyncRequestFactory(), path), **kwargs)
+        if hasattr(response, 'render'):
+            await sync_to_async(response.render)()
+        return response
+
+    async def test_async_views_render_like_sync_views(self):
+        cases = [
+            (CatalogView, AsyncCatalogView, '/catalog/', {}, 'Sneakers'),
+            (CatalogView, AsyncCatalogView, '/catalog/?show_filters=true', {}, 'Shoes'),
+            (CatalogView, AsyncCatalogView, '/catalog/?q=sneak', {}, 'Sneakers'),
+            (CatalogView, AsyncCatalogView, '/catalog/?q=neaker', {}, 'Sneakers'),
+            (CatalogView, AsyncCatalogView, '/catalog/?q=neaker&show_filters=true', {}, 'Shoes'),
+            (ProductDetailView, AsyncProductDetailView, '/product/sneakers', {'slug': 'sneakers'}, 'Sneakers'),
+            (ProfileProductsView, AsyncProfileProductsView, '/users/ann/', {'login': 'ann'}, 'Sneakers'),
+        ]
+        for sync_view, async_view, path, kwargs, text in cases:
+            with self.subTest(path=path):
+                self.assertTrue(async_view.view_is_async)
+                expected = await sync_to_async(self.render_sync)(sync_view, path, kwargs)
+                await sync_to_async(cache.clear)()
+                trigram_enabled.cache_clear()
+                response = await self.render_async(async_view, path, kwargs)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, text)
+                self.assertEqual(response.content, expected)
+
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class BenchmarkCommandTests(TestCase):
+    def setUp(self):
+        # A test replica cannot see this test's uncommitted data, and the
+        # benchmark client has no pin cookie; read from the primary.
+        databases = mock.patch.dict(settings.DATABASES)
+        databases.start()
+        self.addCleanup(databases.stop)
+        settings.DATABASES.pop(REPLICA, None)
+
+    def test_seed_run_and_compare_against_baseline(self):
+        call_command('bench_seed', categories=2, products=30, users=3, wishlist_size=5, stdout=StringIO())
+        self.assertEqual(Product.objects.filter(slug__startswith='bench-').count(), 30)
+        self.assertEqual(WishlistItem.objects.filter(user__login__startswith='bench').count(), 15)
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as baseline:
+            call_command('bench', iterations=3, save_baseline=baseline.name, stdout=StringIO())
+            results = json.load(open(baseline.name))
+            self.assertEqual(set(results), {
+                'catalog', 'catalog_filtered', 'catalog_search', 'product_detail', 'public_wishlist', 'add_to_wishlist',
+            })
+            for name, result in results.items():
+                self.assertEqual(result['errors'], 0, name)
+            self.assertGreater(results['product_detail']['queries'], 0)
+
+            out = StringIO()
+            call_command('bench', iterations=3, baseline=baseline.name, scenario=['catalog'], stdout=out)
+            self.assertIn('catalog            p50_ms', out.getvalue())
+        # add_to_wishlist removes what it added.
+        self.assertEqual(WishlistItem.objects.filter(user__login__startswith='bench').count(), 15)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProductImportTests(TestCase):
+    CSV = (
+        "name,price,category,color,image_url\n"
+        "Sneakers,100,Shoes,white,https://example.com/a.jpg\n"
+        "Sneakers,120,Shoes,black,\n"
+        "Hoodie,50,Tops,,\n"
+        ",10,Tops,,\n"
+        "Cap,cheap,Tops,,\n"
+    )
+
+    def test_csv_import_batches_categories_and_slugs(self):
+        shoes = Category.objects.create(name='Shoes', slug='shoes')
+        Product.objects.create(name='Sneakers', price=1, main_image='p.jpg')
+        with mock.patch('main.tasks.fetch_product_image.delay') as fetch, \
+                self.captureOnCommitCallbacks(execute=True):
+            created, errors = ProductImporter(batch_size=2).run(
+                read_records(StringIO(self.CSV, newline=''), 'csv')
+            )
+        self.assertEqual(created, 3)
+        self.assertEqual(errors, ['line 5: name is required', "line 6: invalid price 'cheap'"])
+        self.assertEqual(
+            sorted(Product.objects.values_list('slug', flat=True)),
+            ['hoodie', 'sneakers', 'sneakers-2', 'sneakers-3'],
+        )
+        self.assertEqual(Product.objects.get(slug='sneakers-2').category, shoes)
+        self.assertEqual(Category.objects.filter(name='Tops').count(), 1)
+        fetch.assert_called_once_with(Product.objects.get(slug='sneakers-2').pk, 'https://example.com/a.jpg')
+
+    def test_jsonl_values_of_the_wrong_type_are_row_errors(self):
+        jsonl = (
+            '{"name": 123, "price": 5, "color": 7}\n'
+            '{"name": "Cap", "price": 5, "category": ["a"]}\n'
+            '{"name": {"en": "Hat"}, "price": 5}\n'
+            '{"name": "Scarf", "price": 5, "description": true}\n'
+        )
+        created, errors = ProductImporter().run(read_records(StringIO(jsonl), 'jsonl'))
+        self.assertEqual(created, 1)
+        self.assertEqual(errors, [
+            'line 2: category must be a string, not list',
+            'line 3: name must be a string, not dict',
+            'line 4: description must be a string, not bool',
+        ])
+        self.assertEqual(Product.objects.get().color, '7')
+
+    def test_failed_batch_still_invalidates_committed_ones(self):
+        records = [(1, {'name': 'Cap', 'price': '5'}), (2, {'name': 'Hat', 'price': '5'})]
+        with mock.patch('main.importer.unique_slugs', side_effect=[['cap'], RuntimeError]), \
+                mock.patch('main.importer.bump_generation') as bump:
+            with self.assertRaises(RuntimeError):
+                ProductImporter(batch_size=1).run(records)
+        self.assertEqual(Product.objects.count(), 1)
+        bump.assert_any_call('products')
+
+    def test_failed_import_still_deletes_the_upload(self):
+        with mock.patch('django.core.files.storage.default_storage.open', mock.mock_open(read_data=b'')), \
+                mock.patch('django.core.files.storage.default_storage.delete') as delete, \
+                mock.patch.object(ProductImporter, 'run', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                import_products_file('imports/products.csv')
+        delete.assert_called_once_with('imports/products.csv')
+
+    def test_jsonl_upload_is_imported_in_the_background(self):
+        staff = CustomUser.objects.create_user('s@example.com', 'staff', 'S', 'S', is_staff=True)
+        self.client.force_login(staff)
+        upload = SimpleUploadedFile('products.jsonl', b'{"name": "Bag", "price": "9.99", "feed": true}\nnot json\n')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/import/products/', {'file': upload})
+        self.assertEqual(response.status_code, 202)
+        product = Product.objects.get(slug='bag')
+        self.assertTrue(product.feed)
+        self.assertEqual(str(product.price), '9.99')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shoes', slug='shoes')
+        cls.products = [
+            Product.objects.create(name=name, price=100, category=category, main_image='p.jpg', feed=True)
+            for name in ('Sneakers', 'Boots <b>')
+        ]
+        cls.owner = CustomUser.objects.create_user('a@example.com', 'ann', 'Ann', 'A', access=True)
+        for position, product in enumerate(reversed(cls.products)):
+            WishlistItem.objects.create(user=cls.owner, product=product, position=position)
+        cls.private = CustomUser.objects.create_user('b@example.com', 'bob', 'Bob', 'B')
+
+    def content(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_wishlist_streams_in_position_order(self):
+        lines = self.content(self.client.get('/users/ann/export.csv?order=position')).splitlines()
+        self.assertTrue(lines[0].startswith('position,added_at,note,product_id,name'))
+        self.assertEqual([line.split(',')[4] for line in lines[1:]], ['Boots <b>', 'Sneakers'])
+        self.assertIn('http://testserver/product/sneakers', lines[2])
+
+        html = self.content(self.client.get('/users/ann/export.html'))
+        self.assertIn('Boots &lt;b&gt;', html)
+        self.assertTrue(html.rstrip().endswith('</html>'))
+
+    def test_wishlist_defaults_to_the_profile_order(self):
+        # Newest first, like ProfileProductsView without ?order=.
+        lines = self.content(self.client.get('/users/ann/export.jsonl')).splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines], ['Sneakers', 'Boots <b>'])
+
+    def test_private_wishlist_is_only_exported_to_its_owner(self):
+        self.assertEqual(self.client.get('/users/bob/export.jsonl').status_code, 404)
+        self.client.force_login(self.private)
+        self.assertEqual(self.content(self.client.get('/users/bob/export.jsonl')), '')
+
+    async def test_asgi_streams_one_chunk_at_a_time(self):
+        response = await self.async_client.get('/users/ann/export.jsonl?order=position')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        lines = b''.join([chunk async for chunk in response.streaming_content]).decode().splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines], ['Boots <b>', 'Sneakers'])
+
+        pulled = []
+
+        def chunks():
+            for chunk in ('a', 'b', 'c'):
+                pulled.append(chunk)
+                yield chunk
+        response = export.streaming_response(AsyncRequestFactory().get('/'), 'csv', chunks(), 'export')
+        streamed = aiter(response.streaming_content)
+        self.assertEqual(await anext(streamed), b'a')
+        self.assertEqual(pulled, ['a'])
+        self.assertEqual([chunk async for chunk in streamed], [b'b', b'c'])
+
+    def test_catalog_export_round_trips_through_the_importer(self):
+        self.assertEqual(self.client.get('/export/catalog.csv').status_code, 302)
+        self.client.force_login(CustomUser.objects.create_user('s@example.com', 'staff', 'S', 'S', is_staff=True))
+        exported = self.content(self.client.get('/export/catalog.csv'))
+        Product.objects.all().delete()
+        created, errors = ProductImporter().run(read_records(StringIO(exported, newline=''), 'csv'))
+        self.assertEqual((created, errors), (2, []))
+        self.assertEqual(
+            sorted(Product.objects.values_list('name', 'category__name')),
+            [('Boots <b>', 'Shoes'), ('Sneakers', 'Shoes')],
+        )
+
+
+class KeysetPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.at = timezone.now().replace(microsecond=123456)
+        cls.products = [Product.objects.create(name=f'P{i}', price=i, main_image='p.jpg') for i in range(5)]
+        # Three products share one timestamp, so pages must break ties on id.
+        for offset, product in zip([0, 1, 1, 1, 2], cls.products):
+            Product.objects.filter(pk=product.pk).update(created_at=cls.at - timedelta(minutes=offset))
+
+    def pages(self, paginator):
+        pages, cursor = [], None
+        while True:
+            page, cursor = paginator.get_page(cursor)
+            pages.append([product.pk for product in page])
+            if cursor is None:
+                return pages
+
+    def test_cursor_round_trips(self):
+        paginator = KeysetPaginator(Product.objects.all(), 2)
+        cursor = paginator.encode_cursor(self.at, 7)
+        self.assertEqual(paginator.decode_cursor(cursor), (self.at, 7))
+        ranked = KeysetPaginator(Product.objects.all(), 2, key='trending_score', parse=float)
+        self.assertEqual(ranked.decode_cursor(ranked.encode_cursor(0.1 + 0.2, 3)), (0.1 + 0.2, 3))
+
+    def test_pages_break_ties_on_id_and_end_without_cursor(self):
+        ids = [product.pk for product in self.products]
+        self.assertEqual(
+            self.pages(KeysetPaginator(Product.objects.all(), 2)),
+            [[ids[0], ids[3]], [ids[2], ids[1]], [ids[4]]],
+        )
+        self.assertEqual(
+            self.pages(KeysetPaginator(Product.objects.all(), 2, key='wishlist_count', parse=int, descending=False)),
+            [ids[:2], ids[2:4], ids[4:]],
+        )
+
+    def test_full_last_page_has_no_cursor(self):
+        page, cursor = KeysetPaginator(Product.objects.all(), 5).get_page()
+        self.assertEqual((len(page), cursor), (5, None))
+
+    def test_invalid_cursor_starts_over(self):
+        paginator = KeysetPaginator(Product.objects.all(), 2)
+        self.assertEqual(paginator.get_page('garbage'), paginator.get_page())
+
+
+
+class FacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        shoes = Category.objects.create(name='Shoes', slug='shoes')
+        bags = Category.objects.create(name='Bags', slug='bags')
+        for name, color, price, category, sizes in [
+            ('Red sneakers', 'Red', 500, shoes, ['40', '41']),
+            ('Red boots', 'red', 4000, shoes, ['41']),
+            ('Blue sneakers', 'Blue', 600, shoes, ['42']),
+            ('Red bag', 'Red', 2000, bags, []),
+        ]:
+            Product.objects.create(
+                name=name, color=color, price=price, category=category, sizes_in_stock=sizes,
+                main_image='p.jpg', feed=True,
+            )
+
+    def counts(self, facets, dimension, key='value'):
+        return {facet[key]: facet['count'] for facet in facets[dimension]}
+
+    def test_unfiltered_counts(self):
+        with self.assertNumQueries(1):
+            facets = compute_facets(Product.objects.all())
+        self.assertEqual(self.counts(facets, 'colors'), {'red': 3, 'blue': 1})
+        self.assertEqual(self.counts(facets, 'sizes'), {'40': 1, '41': 2, '42': 1})
+        self.assertEqual(self.counts(facets, 'categories', 'slug'), {'shoes': 3, 'bags': 1})
+        self.assertEqual(self.counts(facets, 'prices', 'min'), {0: 2, 1000: 1, 3000: 1})
+
+    def test_each_dimension_ignores_its_own_filter(self):
+        facets = compute_facets(Product.objects.all(), {
+            'colors': Q(color__iexact='blue'),
+            'categories': Q(category__slug='shoes'),
+        })
+        self.assertEqual(self.counts(facets, 'colors'), {'red': 2, 'blue': 1})
+        self.assertEqual(self.counts(facets, 'categories', 'slug'), {'shoes': 1})
+        self.assertEqual(self.counts(facets, 'sizes'), {'42': 1})
+        self.assertEqual(self.counts(facets, 'prices', 'min'), {0: 1})
+
+    def test_empty_search_has_no_facets(self):
+        facets = compute_facets(search_products(Product.objects.all(), '!!!'))
+        self.assertEqual(facets, {'colors': [], 'sizes': [], 'categories': [], 'prices': []})
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_filter_modal_keeps_other_colours(self):
+        request = RequestFactory().get('/catalog/shoes/?show_filters=true&color=red')
+        request.user = AnonymousUser()
+        response = CatalogView.as_view()(request, category_slug='shoes').render()
+        facets = response.context_data['facets']
+        self.assertEqual(self.counts(facets, 'colors'), {'red': 2, 'blue': 1})
+        self.assertEqual(self.counts(facets, 'sizes'), {'40': 1, '41': 2})
+
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class GenerationBumpTests(TestCase):
+    def test_generations_move_only_once_the_write_commits(self):
+        category = Category.objects.create(name='Shoes', slug='shoes')
+        product = Product.objects.create(name='Sneakers', price=100, category=category, main_image='p.jpg')
+        names = ('products', f'product:{product.pk}', 'categories')
+        before = get_generations(*names)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.price = 120
+            product.save()
+            category.name = 'Footwear'
+            category.save()
+            self.assertEqual(get_generations(*names), before)
+        after = get_generations(*names)
+        self.assertTrue(all(new != old for new, old in zip(after.split('.'), before.split('.'))))
+
+    def test_changing_a_recommended_product_invalidates_the_pages_listing_it(self):
+        source, recommended, other = [
+            Product.objects.create(name=f'P{i}', price=100, main_image='p.jpg') for i in range(3)
+        ]
+        ProductRecommendation.objects.create(product=source, recommended=recommended, score=1, position=1)
+        before = get_generations(f'product:{source.pk}', f'product:{other.pk}')
+        with self.captureOnCommitCallbacks(execute=True):
+            recommended.price = 90
+            recommended.save()
+        after = get_generations(f'product:{source.pk}', f'product:{other.pk}')
+        self.assertNotEqual(after.split('.')[0], before.split('.')[0])
+        self.assertEqual(after.split('.')[1], before.split('.')[1])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recommended.delete()
+        self.assertNotEqual(get_generations(f'product:{source.pk}'), after.split('.')[0])
+
+class ThumbnailTests(SimpleTestCase):
+    def storage_with_image(self, width, height):
+        storage = InMemoryStorage()
+        buffer = BytesIO()
+        Image.new('RGB', (width, height), 'red').save(buffer, 'PNG')
+        storage.save('products/p.png', ContentFile(buffer.getvalue()))
+        return storage
+
+    def thumbnail_size(self, storage, width):
+        with storage.open(thumbnail_name('products/p.png', width)) as thumbnail:
+            return Image.open(thumbnail).size
+
+    def test_writes_each_width_the_image_is_wider_than(self):
+        storage = self.storage_with_image(800, 400)
+        self.assertEqual(generate_thumbnails('products/p.png', storage), [320, 640])
+        self.assertEqual(self.thumbnail_size(storage, 320), (320, 160))
+        self.assertEqual(self.thumbnail_size(storage, 640), (640, 320))
+        self.assertFalse(storage.exists(thumbnail_name('products/p.png', 1024)))
+
+    def test_narrow_image_is_recorded_at_its_own_width(self):
+        storage = self.storage_with_image(200, 100)
+        self.assertEqual(generate_thumbnails('products/p.png', storage), [200])
+        self.assertEqual(self.thumbnail_size(storage, 200), (200, 100))
+        self.assertFalse(storage.exists(thumbnail_name('products/p.png', 320)))
+
+
+def create_recommendation_data():
+    category = Category.objects.create(name='Shoes', slug='shoes')
+    products = [
+        Product.objects.create(name=f'P{i}', price=100 + i, category=category, main_image='p.jpg', feed=True)
+        for i in range(4)
+    ]
+    for i, product in enumerate(products[1:], 1):
+        user = CustomUser.objects.create_user(f'u{i}@example.com', f'u{i}', 'U', 'U')
+        WishlistItem.objects.create(user=user, product=products[0])
+        WishlistItem.objects.create(user=user, product=product)
+    return products
+
+
+class RecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = create_recommendation_data()
+
+    def recommended(self, product):
+        return list(
+            ProductRecommendation.objects.filter(product=product).order_by('position')
+            .values_list('recommended__name', 'position')
+        )
+
+    def test_rebuild_for_replaces_the_rows_of_the_product(self):
+        rebuild_for([self.products[0].pk])
+        expected = [('P1', 1), ('P2', 2), ('P3', 3)]
+        self.assertEqual(self.recommended(self.products[0]), expected)
+        rebuild_for([self.products[0].pk, self.products[0].pk])
+        self.assertEqual(self.recommended(self.products[0]), expected)
+        self.assertEqual(self.recommended(self.products[1]), [])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_rebuild_for_bumps_generations_after_commit(self):
+        name = f'product:{self.products[0].pk}'
+        before = get_generations(name)
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_for([self.products[0].pk])
+            self.assertEqual(get_generations(name), before)
+        self.assertNotEqual(get_generations(name), before)
+
+    def test_rebuild_for_locks_bigint_ids(self):
+        rebuild_for([self.products[0].pk, 2 ** 40])
+        self.assertEqual(len(self.recommended(self.products[0])), 3)
+
+    def test_rebuild_all(self):
+        rebuild_all()
+        self.assertEqual(len(self.recommended(self.products[1])), 3)
+        self.assertEqual(ProductRecommendation.objects.count(), 12)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ConcurrentRecommendationTests(TransactionTestCase):
+    def test_concurrent_rebuilds_of_a_product_are_serialized(self):
+        product = create_recommendation_data()[0]
+        built, release, errors = threading.Event(), threading.Event(), []
+
+        def rebuild(hold=False):
+            try:
+                with transaction.atomic():
+                    rebuild_for([product.pk])
+                    if hold:
+                        built.set()
+                        release.wait(5)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                built.set()
+                connection.close()
+
+        first = threading.Thread(target=rebuild, kwargs={'hold': True})
+        first.start()
+        built.wait(5)
+        second = threading.Thread(target=rebuild)
+        second.start()
+        second.join(0.2)
+        release.set()
+        first.join()
+        second.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(ProductRecommendation.objects.filter(product=product).count(), 3)
+
+
+class FakeRedis:
+    """The part of the redis client main.popularity uses, in memory."""
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        pass
+
+    def hincrby(self, key, field, amount):
+        fields = self.data.setdefault(key, {})
+        field = str(field).encode()
+        fields[field] = str(int(fields.get(field, 0)) + amount).encode()
+
+    def hsetnx(self, key, field, value):
+        self.data.setdefault(key, {}).setdefault(field.encode(), value.encode())
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def exists(self, key):
+        return key in self.data
+
+    def rename(self, key, new_key):
+        if key not in self.data:
+            raise redis.ResponseError('no such key')
+        self.data[new_key] = self.data.pop(key)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PopularityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [Product.objects.create(name=f'P{i}', price=i, main_image='p.jpg') for i in range(2)]
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch.object(popularity, 'get_client', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def counts(self):
+        return list(Product.objects.order_by('id').values_list('wishlist_count', flat=True))
+
+    def test_flush_applies_recorded_deltas_once(self):
+        first, second = self.products
+        popularity.record({first.pk: 2, second.pk: 1})
+        popularity.record({second.pk: -1})
+        self.assertEqual(popularity.flush(), 1)
+        self.assertEqual(self.counts(), [2, 0])
+        self.assertEqual(popularity.flush(), 0)
+        self.assertEqual(self.counts(), [2, 0])
+
+    def test_flush_after_crash_before_the_update_applies_the_batch(self):
+        popularity.record({self.products[0].pk: 1})
+        self.redis.rename(popularity.PENDING_KEY, popularity.FLUSHING_KEY)
+        popularity.record({self.products[0].pk: 1})
+        self.assertEqual(popularity.flush(), 1)
+        self.assertEqual(self.counts(), [1, 0])
+        self.assertEqual(popularity.flush(), 1)
+        self.assertEqual(self.counts(), [2, 0])
+
+    def test_flush_after_crash_past_the_commit_does_not_apply_twice(self):
+        popularity.record({self.products[0].pk: 1})
+        with mock.patch.object(self.redis, 'delete', side_effect=redis.ConnectionError):
+            with self.assertRaises(redis.ConnectionError):
+                popularity.flush()
+        self.assertEqual(self.counts(), [1, 0])
+        self.assertEqual(popularity.flush(), 0)
+        self.assertEqual(self.counts(), [1, 0])
+        self.assertFalse(self.redis.exists(popularity.FLUSHING_KEY))
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shoes', slug='shoes')
+        for name in ('Running sneakers', 'Canvas sneakers', 'Leather boots'):
+            Product.objects.create(name=name, price=100, category=category, main_image='p.jpg', feed=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, path, **initkwargs):
+        request = RequestFactory().get(path)
+        request.user = AnonymousUser()
+        return CatalogView.as_view(**initkwargs)(request).render()
+
+    def test_full_text_search_runs_one_query(self):
+        with self.assertNumQueries(1):
+            names = {product.name for product in search_products(Product.objects.all(), 'sneak')}
+        self.assertEqual(names, {'Running sneakers', 'Canvas sneakers'})
+
+    @mock.patch('main.search.trigram_enabled', return_value=False)
+    def test_fuzzy_search_matches_substrings(self, trigram_enabled):
+        self.assertFalse(search_products(Product.objects.all(), 'neaker').exists())
+        names = {product.name for product in search_products(Product.objects.all(), 'neaker', fuzzy=True)}
+        self.assertEqual(names, {'Running sneakers', 'Canvas sneakers'})
+
+    @mock.patch('main.search.trigram_enabled', return_value=False)
+    def test_catalog_falls_back_to_fuzzy_search_when_the_page_is_empty(self, trigram_enabled):
+        response = self.get('/catalog/?q=neaker', paginate_by=1)
+        self.assertContains(response, 'sneakers')
+        next_page_url = response.context_data['next_page_url']
+        self.assertIn('fuzzy=1', next_page_url)
+        response = self.get(next_page_url, paginate_by=1)
+        self.assertContains(response, 'sneakers')
+        self.assertIsNone(response.context_data['next_page_url'])
+
+    def test_catalog_does_not_fall_back_when_full_text_matches(self):
+        with mock.patch('main.views.search_products', wraps=search_products) as search:
+            response = self.get('/catalog/?q=boots', paginate_by=1)
+        self.assertContains(response, 'Leather boots')
+        search.assert_called_once_with(mock.ANY, 'boots', False)
@@ -1,11 +1,17 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+CatalogView = views.AsyncCatalogView if settings.ASYNC_VIEWS else views.CatalogView
+ProductDetailView = views.AsyncProductDetailView if settings.ASYNC_VIEWS else views.ProductDetailView
+
 app_name = 'main'
 
 urlpatterns = [
     path('', views.IndexView.as_view(), name='index'),
-    path('catalog/', views.CatalogView.as_view(), name='catalog_all'),
-    path('catalog/<slug:category_slug>/', views.CatalogView.as_view(), name='catalog'),
-    path('product/<slug:slug>', views.ProductDetailView.as_view(), name='product_detail') 
+    path('catalog/', CatalogView.as_view(), name='catalog_all'),
+    path('catalog/<slug:category_slug>/', CatalogView.as_view(), name='catalog'),
+    path('product/<slug:slug>', ProductDetailView.as_view(), name='product_detail'),
+    path('import/products/', views.import_products, name='import_products'),
+    path('export/catalog.<str:format>', views.export_catalog, name='export_catalog'),
 ]
\ No newline at end of file
@@ -1,16 +1,42 @@
-from django.shortcuts import get_object_or_404
+import os
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils.decorators import method_decorator
+from wishlist.db_router import reads_from_replica, replica_reads
+from wishlist.instrumentation import query_budget
 from django.views.generic import TemplateView, DetailView
-from django.http import HttpResponse
-from django.template.response import TemplateResponse
-from .models import Category, Product, Size
 from django.db.models import Q
+from django.http import HttpResponse, Http404, JsonResponse
+from django.template.response import TemplateResponse
+from .models import Product
+from .cache import (
+    acached_fragment, aget_categories, aget_generations, aget_validators, cached_fragment,
+    get_categories, get_generations, get_validators, not_modified, set_validators,
+)
+from . import export
+from .facets import compute_facets
+from .feed import get_home_feed
+from .pagination import KeysetPaginator
+from .importer import format_for
+from .search import search_products
+from .tasks import import_products_file
 
+# Budgets include a cold session and user lookup (2 queries).
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+@method_decorator(query_budget(4), name='dispatch')
 class IndexView(TemplateView):
     template_name = 'main/index.html'
 
-    # You can remove get_context_data entirely if you're not using it
-    # def get_context_data(self, **kwargs):
-    #     return super().get_context_data(**kwargs)
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        feed = get_home_feed()
+        context['feed_products'] = feed['products']
+        context['feed_categories'] = feed['categories']
+        return context
 
     def get(self, request, *args, **kwargs):
         context = self.get_context_data(**kwargs)
@@ -18,69 +44,217 @@ class IndexView(TemplateView):
             return TemplateResponse(request, 'main/home_content.html', context)
         return TemplateResponse(request, self.template_name, context)
 
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+@method_decorator(replica_reads, name='dispatch')
+@method_decorator(query_budget(4), name='dispatch')
 class CatalogView(TemplateView):
     template_name = 'main/catalog.html'
+    paginate_by = 24
 
+    # ?param= -> (facet it narrows, condition for a value).
     FILTER_MAPPING = {
-        'color': lambda queryset, value: queryset.filter(color__iexact=value),
-        'min_price': lambda queryset, value: queryset.filter(price__gte=float(value)),
-        'max_price': lambda queryset, value: queryset.filter(price__lte=float(value)),  
-        'size': lambda queryset, value: queryset.filter(productsizes__sizes__name=value).distinct()  
+        'color': ('colors', lambda value: Q(color__iexact=value)),
+        'min_price': ('prices', lambda value: Q(price__gte=float(value))),
+        'max_price': ('prices', lambda value: Q(price__lte=float(value))),
+        'size': ('sizes', lambda value: Q(sizes_in_stock__contains=[value])),
+    }
+    # ?sort= value -> (keyset column, cursor parser); both have a feed index.
+    SORT_MAPPING = {
+        'popular': ('wishlist_count', int),
+        'trending': ('trending_score', float),
     }
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        category_slug = kwargs.get('category_slug')
-        categories = Category.objects.all()
-        products = Product.objects.all().order_by('-created_at') 
+    def filter_products(self, categories, fuzzy=False):
+        """The searched product queryset, the filters to apply to it per
+        facet dimension, and the filter state. Builds the queryset only;
+        nothing is fetched."""
+        category_slug = self.kwargs.get('category_slug')
+        products = Product.objects.filter(feed=True)
+        filters = {}
         current_category = None
         if category_slug:
-            current_category = get_object_or_404(Category, slug=category_slug)
-            products = products.filter(category=current_category)
+            current_category = next((c for c in categories if c.slug == category_slug), None)
+            if current_category is None:
+                raise Http404("No Category matches the given query.")
+            filters['categories'] = Q(category=current_category)
         
         query = self.request.GET.get('q')
         if query:
-            products = products.filter(
-                Q(name__icontains=query) | Q(description__icontains=query)
-            )
+            products = search_products(products, query, fuzzy)
         
         filter_params = {}
-        for param, filter_func in self.FILTER_MAPPING.items():
+        for param, (facet, condition) in self.FILTER_MAPPING.items():
             value = self.request.GET.get(param)
             if value:
                 try:
-                    products = filter_func(products, value)
+                    filters[facet] = filters.get(facet, Q()) & condition(value)
                     filter_params[param] = value
                 except (ValueError, TypeError):
                     
                     continue
         
         filter_params['q'] = query or ''
+        sort = self.get_sort()
+        filter_params['sort'] = sort or ''
+        return products, filters, current_category, filter_params
+
+    def get_paginator(self, products):
+        sort = self.get_sort()
+        if sort:
+            key, parse = self.SORT_MAPPING[sort]
+            return KeysetPaginator(products, self.paginate_by, key=key, parse=parse)
+        if self.request.GET.get('q'):
+            return KeysetPaginator(products, self.paginate_by, key='rank', parse=float)
+        return KeysetPaginator(products, self.paginate_by)
+
+    def get_next_page_url(self, next_cursor):
+        if not next_cursor:
+            return None
+        params = self.request.GET.copy()
+        params['cursor'] = next_cursor
+        if self.fuzzy:
+            # Later pages continue the fallback search the first page used.
+            params['fuzzy'] = '1'
+        return f"{self.request.path}?{params.urlencode()}"
+
+    def show_filters(self):
+        return self.request.GET.get('show_filters') == 'true'
 
+    def needs_fuzzy(self, filter_params, page, facets):
+        """Whether a full-text search found nothing on its first page, so
+        the fuzzy search should run instead."""
+        if self.fuzzy or not filter_params['q'] or self.request.GET.get('cursor'):
+            return False
+        return not any(facets.values()) if self.show_filters() else not page
+
+    def fetch(self, products, filters):
+        if self.show_filters():
+            return [], None, compute_facets(products, filters)
+        products = products.filter(*filters.values())
+        page, next_cursor = self.get_paginator(products).get_page(self.request.GET.get('cursor'))
+        return page, next_cursor, None
+
+    async def afilter_products(self, categories):
+        # Searching may query (the pg_trgm check), so it runs off the event loop.
+        return await sync_to_async(self.filter_products)(categories, self.fuzzy)
+
+    async def afetch(self, products, filters):
+        if self.show_filters():
+            return [], None, await sync_to_async(compute_facets)(products, filters)
+        products = products.filter(*filters.values())
+        page, next_cursor = await self.get_paginator(products).aget_page(self.request.GET.get('cursor'))
+        return page, next_cursor, None
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        categories = get_categories()
+        self.fuzzy = self.request.GET.get('fuzzy') == '1'
+        products, filters, current_category, filter_params = self.filter_products(categories, self.fuzzy)
+        page, next_cursor, facets = self.fetch(products, filters)
+        if self.needs_fuzzy(filter_params, page, facets):
+            self.fuzzy = True
+            products, filters, current_category, filter_params = self.filter_products(categories, self.fuzzy)
+            page, next_cursor, facets = self.fetch(products, filters)
+        return self.update_context(context, categories, current_category, filter_params, page, next_cursor, facets)
+
+    async def aget_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        categories = await aget_categories()
+        self.fuzzy = self.request.GET.get('fuzzy') == '1'
+        products, filters, current_category, filter_params = await self.afilter_products(categories)
+        page, next_cursor, facets = await self.afetch(products, filters)
+        if self.needs_fuzzy(filter_params, page, facets):
+            self.fuzzy = True
+            products, filters, current_category, filter_params = await self.afilter_products(categories)
+            page, next_cursor, facets = await self.afetch(products, filters)
+        return self.update_context(context, categories, current_category, filter_params, page, next_cursor, facets)
+
+    def update_context(self, context, categories, current_category, filter_params, page, next_cursor, facets):
         context.update({
             'categories': categories,
-            'products': products,
+            'products': page,
+            'next_page_url': self.get_next_page_url(next_cursor),
             'current_category': current_category,  
             'filter_params': filter_params,
-            'sizes': Size.objects.all(),
-            'search_query': query or '',
+            'facets': facets,
+            'show_filters': self.show_filters(),
+            'search_query': filter_params['q'],
             'show_search': self.request.GET.get('show_search') == 'true',
             'reset_search': self.request.GET.get('reset_search') == 'true'
         })
         
         return context
 
+    def get_sort(self):
+        sort = self.request.GET.get('sort')
+        return sort if sort in self.SORT_MAPPING else None
+
+    def get_generation_names(self):
+        names = ['products', 'categories', 'sizes']
+        if self.get_sort():
+            names.append('popularity')
+        return names
+
+    def get_fragment_template(self):
+        if self.request.GET.get('show_search') == 'true':
+            return "main/search_input.html"
+        elif self.request.GET.get('reset_search') == 'true':
+            return "main/search_button.html"
+        elif self.request.GET.get('cursor'):
+            return "main/catalog_page.html"
+        elif self.request.GET.get('show_filters') == 'true':
+            return "main/filter_modal.html"
+        return 'main/catalog_content.html'
+
     def get(self, request, *args, **kwargs):
-        context = self.get_context_data(**kwargs)
-        if request.headers.get("HX-Request"):
-            if context.get('show_search'):
-                return TemplateResponse(request, "main/search_input.html", context)
-            elif context.get('reset_search'):
-                return TemplateResponse(request, "main/search_button.html", context)  
-            template = "main/filter_modal.html" if request.GET.get('show_filters') == 'true' else 'main/catalog_content.html'
-            return TemplateResponse(request, template, context)
-        return TemplateResponse(request, self.template_name, context)
+        is_htmx = bool(request.headers.get("HX-Request"))
+        names = self.get_generation_names()
+        etag, last_modified = get_validators(request, *names, per_user=not is_htmx)
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        if is_htmx:
+            response = cached_fragment(
+                request,
+                self.get_fragment_template(),
+                lambda: self.get_context_data(**kwargs),
+                kwargs.get('category_slug'),
+                get_generations(*names),
+            )
+        else:
+            context = self.get_context_data(**kwargs)
+            response = TemplateResponse(request, self.template_name, context)
+        return set_validators(response, etag, last_modified)
+
+
+class AsyncCatalogView(CatalogView):
+    """CatalogView for the ASGI profile: cache lookups and the page query
+    are awaited, so a worker serves other requests meanwhile."""
+
+    async def get(self, request, *args, **kwargs):
+        is_htmx = bool(request.headers.get("HX-Request"))
+        names = self.get_generation_names()
+        etag, last_modified = await aget_validators(request, *names, per_user=not is_htmx)
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        if is_htmx:
+            response = await acached_fragment(
+                request,
+                self.get_fragment_template(),
+                lambda: self.aget_context_data(**kwargs),
+                kwargs.get('category_slug'),
+                await aget_generations(*names),
+            )
+        else:
+            context = await self.aget_context_data(**kwargs)
+            response = TemplateResponse(request, self.template_name, context)
+        return set_validators(response, etag, last_modified)
+
     
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+@method_decorator(replica_reads, name='dispatch')
+@method_decorator(query_budget(7), name='dispatch')
 class ProductDetailView(DetailView):
     model = Product
     template_name = 'main/product_detail.html'
@@ -88,15 +262,30 @@ class ProductDetailView(DetailView):
     slug_url_kwarg = 'slug'
 
 
+    def get_queryset(self):
+        return Product.objects.select_related('category')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        product = self.get_object()
-        context['categories'] = Category.objects.all()
+        product = self.object
+        # Left lazy: they are only evaluated when the cached fragments
+        # that render them miss, and then once each.
+        context['images'] = product.images.all()
+        context['product_sizes'] = product.product_sizes.select_related('size')
+        context['related_products'] = Product.objects.filter(
+            recommended_for__product=product
+        ).order_by('recommended_for__position')
+        # AsyncProductDetailView fetches these itself and passes them in.
+        if 'categories' not in context:
+            context['categories'] = get_categories()
+        if 'product_generation' not in context:
+            context['product_generation'] = get_generations(*self.get_generation_names())
+        if 'user_login' not in context:
+            if self.request.user.is_authenticated:
+                context['user_login'] = self.request.user.login
+            else:
+                context['user_login'] = None
         context['url'] = product.url
-        if self.request.user.is_authenticated:
-            context['user_login'] = self.request.user.login
-        else:
-            context['user_login'] = None
         if product.category:
             context['current_category'] = product.category.slug
         else:
@@ -104,9 +293,80 @@ class ProductDetailView(DetailView):
         return context
     
 
+    def get_generation_names(self):
+        return f'product:{self.object.pk}', 'categories', 'sizes', 'recommendations'
+
     def get(self, request, *args, **kwargs):
+        on_replica = reads_from_replica()
         self.object = self.get_object()
+        etag, last_modified = get_validators(request, *self.get_generation_names())
+        if on_replica and not reads_from_replica():
+            # The replica lags behind a bump: reread the product on the primary.
+            self.object = self.get_object()
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
         context = self.get_context_data(**kwargs)
         if request.headers.get('HX-Request'):
-            return TemplateResponse(request, 'main/product_detail_content.html', context)
-        return TemplateResponse(request, self.template_name, context)
+            response = TemplateResponse(request, 'main/product_detail_content.html', context)
+        else:
+            response = TemplateResponse(request, self.template_name, context)
+        return set_validators(response, etag, last_modified)
+
+
+class AsyncProductDetailView(ProductDetailView):
+    async def aget_object(self):
+        try:
+            return await self.get_queryset().aget(**{self.slug_field: self.kwargs[self.slug_url_kwarg]})
+        except Product.DoesNotExist:
+            raise Http404("No Product matches the given query.")
+
+    async def get(self, request, *args, **kwargs):
+        on_replica = reads_from_replica()
+        self.object = await self.aget_object()
+        names = self.get_generation_names()
+        etag, last_modified = await aget_validators(request, *names)
+        if on_replica and not reads_from_replica():
+            self.object = await self.aget_object()
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        user = await request.auser()
+        context = self.get_context_data(
+            categories=await aget_categories(),
+            product_generation=await aget_generations(*names),
+            user_login=user.login if user.is_authenticated else None,
+            **kwargs
+        )
+        if request.headers.get('HX-Request'):
+            response = TemplateResponse(request, 'main/product_detail_content.html', context)
+        else:
+            response = TemplateResponse(request, self.template_name, context)
+        return set_validators(response, etag, last_modified)
+
+
+@staff_member_required
+def import_products(request):
+    """Accept a CSV or JSONL product file as ``file`` and import it in the
+    background; see main.importer for the columns."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    upload = request.FILES.get('file')
+    if upload is None:
+        return JsonResponse({'error': 'Expected a CSV or JSONL file'}, status=400)
+    format = format_for(upload.name)
+    name = default_storage.save(f'imports/{uuid.uuid4().hex}{os.path.splitext(upload.name)[1]}', upload)
+    feed = request.POST.get('feed') == 'true'
+    transaction.on_commit(lambda: import_products_file.delay(name, format, feed=feed))
+    return JsonResponse({'file': name, 'format': format}, status=202)
+
+
+@transaction.non_atomic_requests
+@staff_member_required
+def export_catalog(request, format):
+    """The catalog as CSV or JSONL, streamed; ``?all=true`` includes
+    products that are not in the feed."""
+    if format not in ('csv', 'jsonl'):
+        raise Http404("Unknown export format")
+    rows = export.catalog_rows(request.build_absolute_uri('/'), feed_only=request.GET.get('all') != 'true')
+    return export.streaming_response(request, format, export.render(format, rows, export.CATALOG_COLUMNS), 'catalog')
@@ -1,6 +1,13 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser
+from .models import CustomUser, OutgoingEmail, WishlistItem
+from .wishlist import wishlist_changed
+
+
+class WishlistItemInline(admin.TabularInline):
+    model = WishlistItem
+    extra = 0
+    raw_id_fields = ['product']
 
 
 class CustomUserAdmin(UserAdmin):
@@ -12,7 +19,7 @@ class CustomUserAdmin(UserAdmin):
     fieldsets = (
         (None, {'fields': ('email', 'password')}),
         ('Personal Info', {
-            'fields': ('login', 'first_name', 'last_name', 'products', 'access')
+            'fields': ('login', 'first_name', 'last_name', 'access')
         }),
         ('Permissions', {
             'fields': ('is_active', 'is_staff', 'is_superuser',
@@ -31,8 +38,14 @@ class CustomUserAdmin(UserAdmin):
         }),
     )
     
-    # Добавляем фильтр горизонтальный для товаров
-    filter_horizontal = ('products', 'groups', 'user_permissions')
+    filter_horizontal = ('groups', 'user_permissions')
+    inlines = [WishlistItemInline]
+
+    def save_formset(self, request, form, formset, change):
+        super().save_formset(request, form, formset, change)
+        if formset.model is WishlistItem and formset.deleted_objects:
+            items = [(item.user_id, item.product_id) for item in formset.deleted_objects]
+            wishlist_changed.send(sender=WishlistItem, items=items, delta=-1)
 
     def get_form(self, request, obj=None, **kwargs):
         form = super().get_form(request, obj, **kwargs)
@@ -41,4 +54,12 @@ class CustomUserAdmin(UserAdmin):
         return form
 
 
-admin.site.register(CustomUser, CustomUserAdmin)
\ No newline at end of file
+admin.site.register(CustomUser, CustomUserAdmin)
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('to', 'subject', 'status', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to', 'subject', 'dedupe_key')
+    readonly_fields = ('dedupe_key', 'created_at', 'sent_at', 'last_error')
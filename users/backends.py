@@ -0,0 +1,41 @@
+"""Authentication backend that keeps the logged-in user in the cache.
+
+AuthenticationMiddleware loads request.user from the backend on every
+request; with sessions in cached_db this backend makes an authenticated
+request cost no auth queries at all. The entry is dropped whenever the
+user row is saved (see signals.py), which also covers password changes,
+so the session hash check still logs out other sessions.
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+USER_TIMEOUT = 60 * 15
+
+
+def user_cache_key(user_id):
+    return f'auth_user:{user_id}'
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            try:
+                user = get_user_model()._default_manager.get(pk=user_id)
+            except get_user_model().DoesNotExist:
+                return None
+            cache.set(key, user, USER_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        key = user_cache_key(user_id)
+        user = await cache.aget(key)
+        if user is None:
+            try:
+                user = await get_user_model()._default_manager.aget(pk=user_id)
+            except get_user_model().DoesNotExist:
+                return None
+            await cache.aset(key, user, USER_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
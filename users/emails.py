@@ -0,0 +1,180 @@
+"""Email templates and outbox.
+
+Tasks ``render_email`` and ``enqueue`` the result; ``drain_outbox``
+sends the due ones in batches over a single SMTP connection, so a burst
+of registrations pays for one TLS handshake per batch instead of one per
+message.
+"""
+import logging
+import re
+import time
+from datetime import timedelta
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.template import Context, Engine
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+# Stay under the SMTP provider's sending rate.
+MAX_PER_SECOND = 5
+MAX_ATTEMPTS = 5
+# How long a drain owns the rows it claimed; a drain that dies leaves
+# them to the next one after this.
+CLAIM_LEASE = timedelta(minutes=15)
+RETRY_BASE = timedelta(minutes=1)
+# Enqueues within this many seconds share one drain task.
+KICK_INTERVAL = 5
+
+TEMPLATE_DIR = Path(__file__).resolve().parent / 'templates' / 'users' / 'emails'
+DEFAULT_LANGUAGE = 'ru'
+CSS_RULE = re.compile(r'\.([\w-]+)\s*\{([^}]*)\}')
+CLASS_ATTR = re.compile(r'class="([^"]*)"')
+
+
+def _inline_css(source, rules):
+    def replace(match):
+        declarations = [rules[name] for name in match.group(1).split() if name in rules]
+        return f'style="{"; ".join(declarations)}"' if declarations else match.group(0)
+    return CLASS_ATTR.sub(replace, source)
+
+
+@lru_cache(maxsize=None)
+def _engine():
+    """A template engine over TEMPLATE_DIR whose HTML sources already have
+    styles.css inlined, so it is done once per worker, not per message."""
+    css = re.sub(r'/\*.*?\*/', '', (TEMPLATE_DIR / 'styles.css').read_text(), flags=re.S)
+    rules = {name: ' '.join(body.split()).rstrip(';') for name, body in CSS_RULE.findall(css)}
+    sources = {}
+    for path in TEMPLATE_DIR.rglob('*'):
+        if path.suffix in ('.html', '.txt'):
+            source = path.read_text()
+            if path.suffix == '.html':
+                source = _inline_css(source, rules)
+            sources[path.relative_to(TEMPLATE_DIR).as_posix()] = source
+    return Engine(loaders=[('django.template.loaders.locmem.Loader', sources)])
+
+
+def _languages(language):
+    candidates = [language.lower(), language.lower().split('-')[0], DEFAULT_LANGUAGE]
+    return list(dict.fromkeys(candidates))
+
+
+@lru_cache(maxsize=None)
+def get_email_templates(name, language=DEFAULT_LANGUAGE):
+    """Compiled (subject, text, html) templates of email ``name`` for
+    ``language``, falling back to its base language and DEFAULT_LANGUAGE."""
+    engine = _engine()
+    languages = _languages(language)
+    return tuple(
+        engine.select_template([f'{code}/{name}.{suffix}' for code in languages])
+        for suffix in ('subject.txt', 'txt', 'html')
+    )
+
+
+def render_email(name, context, language=DEFAULT_LANGUAGE):
+    """Returns (subject, text body, HTML body)."""
+    subject, text, html = get_email_templates(name, language)
+    return (
+        ' '.join(subject.render(Context(context, autoescape=False)).split()),
+        text.render(Context(context, autoescape=False)),
+        html.render(Context(context)),
+    )
+
+
+def enqueue(dedupe_key, to, subject, body, html_body='', urgent=False):
+    """Add a message to the outbox unless ``dedupe_key`` is already
+    there, and schedule a drain once the transaction commits. Urgent
+    messages are drained right away on the interactive queue, ahead of
+    any bulk backlog."""
+    OutgoingEmail.objects.bulk_create(
+        [OutgoingEmail(dedupe_key=dedupe_key, to=to, subject=subject, body=body, html_body=html_body, urgent=urgent)],
+        ignore_conflicts=True,
+    )
+    transaction.on_commit(lambda: _kick(urgent))
+
+
+def _kick(urgent):
+    from .tasks import drain_email_outbox
+
+    if urgent:
+        drain_email_outbox.apply_async(kwargs={'urgent': True}, queue='interactive')
+    elif cache.add('email_outbox:kick', 1, KICK_INTERVAL):
+        drain_email_outbox.apply_async(countdown=KICK_INTERVAL)
+
+
+def _build_message(email, connection):
+    message = EmailMultiAlternatives(
+        email.subject, email.body, settings.DEFAULT_FROM_EMAIL, [email.to], connection=connection
+    )
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def _mark_failed(email, error):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = OutgoingEmail.FAILED
+    else:
+        email.status = OutgoingEmail.PENDING
+        email.next_attempt_at = timezone.now() + RETRY_BASE * 2 ** (email.attempts - 1)
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def _claim(batch_size, urgent):
+    """Mark up to ``batch_size`` due messages SENDING for CLAIM_LEASE and
+    return them. Rows are picked with SKIP LOCKED and the transaction
+    ends before any mail goes out, so concurrent drains never claim the
+    same message."""
+    now = timezone.now()
+    due = OutgoingEmail.objects.filter(
+        status__in=[OutgoingEmail.PENDING, OutgoingEmail.SENDING], next_attempt_at__lte=now
+    )
+    if urgent:
+        due = due.filter(urgent=True)
+    with transaction.atomic():
+        batch = list(
+            due.select_for_update(skip_locked=True)
+            .order_by('-urgent', 'next_attempt_at', 'id')[:batch_size]
+        )
+        OutgoingEmail.objects.filter(pk__in=[email.pk for email in batch]).update(
+            status=OutgoingEmail.SENDING, next_attempt_at=now + CLAIM_LEASE
+        )
+    return batch
+
+
+def drain_outbox(batch_size=BATCH_SIZE, urgent=False):
+    """Try up to ``batch_size`` due messages, urgent ones first, and
+    return how many were tried. ``urgent`` limits the batch to urgent
+    messages. Each message is marked SENT as soon as it goes out, so a
+    drain that dies mid-batch resends at most the one in flight."""
+    batch = _claim(batch_size, urgent)
+    if not batch:
+        return 0
+
+    sent = 0
+    interval = 1 / MAX_PER_SECOND
+    with get_connection(fail_silently=False) as connection:
+        for email in batch:
+            started = time.monotonic()
+            try:
+                connection.send_messages([_build_message(email, connection)])
+            except Exception as e:
+                logger.error(f"Failed to send email {email.pk} to {email.to}: {str(e)}")
+                _mark_failed(email, e)
+            else:
+                OutgoingEmail.objects.filter(pk=email.pk).update(status=OutgoingEmail.SENT, sent_at=timezone.now())
+                sent += 1
+            time.sleep(max(0, interval - (time.monotonic() - started)))
+    logger.info(f"Sent {sent} of {len(batch)} outbox emails")
+    return len(batch)
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.3 on 2026-10-18 16:48
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_product_recommendation'),
+        ('users', '0006_customuser_access'),
+    ]
+
+    operations = [
+        # The auto-created M2M table already has exactly these columns and
+        # unique constraint, so only the migration state changes here.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='WishlistItem',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='wishlist_items', to='main.product')),
+                        ('user', models.ForeignKey(db_column='customuser_id', on_delete=django.db.models.deletion.CASCADE, related_name='wishlist_items', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'users_customuser_products',
+                        'unique_together': {('user', 'product')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='customuser',
+                    name='products',
+                    field=models.ManyToManyField(blank=True, related_name='user_products', through='users.WishlistItem', to='main.product'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='wishlistitem',
+            name='added_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='wishlistitem',
+            index=models.Index(fields=['user', '-added_at', '-id'], name='wishlist_user_added_idx'),
+        ),
+    ]
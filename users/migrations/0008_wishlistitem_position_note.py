@@ -0,0 +1,40 @@
+# Generated by Django 5.2.3 on 2026-10-18 16:49
+
+from django.db import migrations, models
+
+
+NUMBER_POSITIONS = """
+UPDATE users_customuser_products AS item
+SET position = numbered.position
+FROM (
+    SELECT id, row_number() OVER (PARTITION BY customuser_id ORDER BY added_at, id) AS position
+    FROM users_customuser_products
+) AS numbered
+WHERE item.id = numbered.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_product_recommendation'),
+        ('users', '0007_wishlistitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wishlistitem',
+            name='note',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='wishlistitem',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='wishlistitem',
+            index=models.Index(fields=['user', 'position', 'id'], name='wishlist_user_position_idx'),
+        ),
+        migrations.RunSQL(NUMBER_POSITIONS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.3 on 2026-10-18 16:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='outgoingemail',
+            name='outgoing_email_pending_idx',
+        ),
+        migrations.AddField(
+            model_name='outgoingemail',
+            name='urgent',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='outgoingemail',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['-urgent', 'next_attempt_at', 'id'], name='outgoing_email_pending_idx'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser, BaseUserManager
+from django.utils import timezone
 
 from main.models import Product, ProductImage,Category,ProductSize
 
@@ -40,7 +41,7 @@ class CustomUser(AbstractUser):
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
     access = models.BooleanField(default=False)
-    products = models.ManyToManyField(Product, related_name='user_products', blank=True)
+    products = models.ManyToManyField(Product, through='WishlistItem', related_name='user_products', blank=True)
 
     objects = CustomUserManager()
 
@@ -48,8 +49,65 @@ class CustomUser(AbstractUser):
     REQUIRED_FIELDS = ['login', 'first_name', 'last_name']
 
     def get_product_ids(self):
-        return list(self.products.all())
+        return list(self.wishlist_items.values_list('product_id', flat=True))
 
     def __str__(self):
         return self.email
 
+
+
+class WishlistItem(models.Model):
+    # Reuses the table and columns of the former auto-created M2M table.
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, db_column='customuser_id', related_name='wishlist_items')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='wishlist_items')
+    added_at = models.DateTimeField(default=timezone.now)
+    position = models.PositiveIntegerField(default=0)
+    note = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        db_table = 'users_customuser_products'
+        unique_together = [('user', 'product')]
+        indexes = [
+            models.Index(fields=['user', '-added_at', '-id'], name='wishlist_user_added_idx'),
+            models.Index(fields=['user', 'position', 'id'], name='wishlist_user_position_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} in {self.user_id}'s wishlist"
+
+
+class OutgoingEmail(models.Model):
+    """A rendered message waiting for users.emails.drain_outbox."""
+    PENDING = 'pending'
+    # Claimed by a drain until next_attempt_at, then due again.
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (SENDING, 'Sending'), (SENT, 'Sent'), (FAILED, 'Failed')]
+
+    # Enqueueing a message whose key is already in the outbox is a no-op.
+    dedupe_key = models.CharField(max_length=255, unique=True)
+    to = models.EmailField(max_length=254)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    # Sent ahead of everything else, from the interactive queue.
+    urgent = models.BooleanField(default=False)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['-urgent', 'next_attempt_at', 'id'],
+                condition=models.Q(status__in=['pending', 'sending']),
+                name='outgoing_email_due_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.to} ({self.status})"
@@ -0,0 +1,50 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from main.models import Product
+from main.popularity import record_on_commit
+from main.tasks import refresh_recommendations
+
+from .backends import user_cache_key
+from .models import CustomUser, WishlistItem
+from .wishlist import wishlist_changed
+
+
+@receiver(wishlist_changed)
+def wishlist_items_changed(sender, items, delta, **kwargs):
+    items = list(items)
+    if not items:
+        return
+    user_ids = sorted({user_id for user_id, _ in items})
+    product_ids = sorted({product_id for _, product_id in items})
+    transaction.on_commit(lambda: refresh_recommendations.delay(user_ids, product_ids))
+    record_on_commit([product_id for _, product_id in items], delta)
+
+
+# users.wishlist sends wishlist_changed itself; these cover items saved
+# one by one, e.g. from the admin, and the items a user or product delete
+# cascades to. A post_delete receiver on WishlistItem would make those
+# cascades load and signal row by row, so they send one batch up front.
+@receiver(post_save, sender=WishlistItem)
+def wishlist_item_saved(sender, instance, created, **kwargs):
+    if created:
+        wishlist_changed.send(sender=WishlistItem, items=[(instance.user_id, instance.product_id)], delta=1)
+
+
+@receiver(pre_delete, sender=CustomUser)
+@receiver(pre_delete, sender=Product)
+def wishlist_owner_deleted(sender, instance, **kwargs):
+    field = 'user' if sender is CustomUser else 'product'
+    items = WishlistItem.objects.filter(**{field: instance}).values_list('user_id', 'product_id')
+    wishlist_changed.send(sender=WishlistItem, items=list(items), delta=-1)
+
+
+# Profile edits, password changes and last_login updates all save the
+# row; drop the cached copy once the new one is visible to other requests.
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def user_changed(sender, instance, **kwargs):
+    key = user_cache_key(instance.pk)
+    transaction.on_commit(lambda: cache.delete(key))
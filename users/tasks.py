@@ -1,43 +1,20 @@
 from celery import shared_task
-from django.core.mail import send_mail
 from django.conf import settings
 import logging
+import time
+
+from .emails import BATCH_SIZE, DEFAULT_LANGUAGE, drain_outbox, enqueue, render_email
 
 logger = logging.getLogger(__name__)
 
 @shared_task
-def send_welcome_email(email, first_name):
-    subject = "Добро пожаловать!"
-    message = f"""
-    Привет, {first_name},
-
-    Спасибо, что присоединились к моему сайту! .
-    Исследуйте  возможности wishlist и пользуйтесь с удобством.
-
-    Если будут вопросы/пожелания пишите на эту почту!
-    """
-    html_message = f"""
-    <h1>Добро пожаловать, {first_name}!</h1>
-    <p>Спасибо, что присоединились к моему сайту! Мы рады видеть вас с нами.</p>
-    <p>Исследуйте  возможности wishlist и пользуйтесь с удобством.</p>
-    <p>Если будут вопросы/пожелания пишите на эту почту!</p>
-    """
-    try:
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [email],
-            fail_silently=False,
-            html_message=html_message
-        )
-        logger.info(f"Приветственное письмо отправлено на {email}")
-    except Exception as e:
-        logger.error(f"Не удалось отправить приветственное письмо на {email}: {str(e)}")
-        raise
+def send_welcome_email(email, first_name, language=DEFAULT_LANGUAGE):
+    rendered = render_email('welcome', {'first_name': first_name}, language)
+    enqueue(f'welcome:{email}', email, *rendered)
+    logger.info(f"Приветственное письмо поставлено в очередь для {email}")
 
 @shared_task
-def send_password_reset_email(email, user_id):
+def send_password_reset_email(email, user_id, language=DEFAULT_LANGUAGE):
     from .models import CustomUser
     from django.urls import reverse
     from django.contrib.auth.tokens import default_token_generator
@@ -50,34 +27,17 @@ def send_password_reset_email(email, user_id):
         token = default_token_generator.make_token(user)
         uid = urlsafe_base64_encode(force_bytes(user.pk))
         reset_url = f"{settings.SITE_URL}{reverse('users:password_reset_confirm', kwargs={'uidb64': uid, 'token': token})}"
-        subject = "Запрос на сброс пароля"
-        message = f"""
-        Привет {user.first_name or user.email},
-
-        Пожалуйста, перейдите по ссылке ниже, чтобы сбросить ваш пароль:
-        {reset_url}
-
-        Если вы не запрашивали сброс пароля, проигнорируйте это письмо.
-
-        Если будут вопросы/пожелания пишите на эту почту!
-        """
-        html_message = f"""
-        <h1>Запрос на сброс пароля</h1>
-        <p>Привет {user.first_name or user.email},</p>
-        <p>Пожалуйста, перейдите по ссылке ниже, чтобы сбросить ваш пароль:</p>
-        <p><a href="{reset_url}">{reset_url}</a></p>
-        <p>Если вы не запрашивали сброс пароля, проигнорируйте это письмо.</p>
-        <p>Если будут вопросы/пожелания пишите на эту почту!</p>
-        """
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [email],
-            fail_silently=False,
-            html_message=html_message
-        )
-        logger.info(f"Письмо для сброса пароля отправлено на {email}")
+        rendered = render_email('password_reset', {'name': user.first_name or user.email, 'reset_url': reset_url}, language)
+        # Repeated clicks within the same minute send one email.
+        enqueue(f'password_reset:{user.pk}:{int(time.time()) // 60}', email, *rendered, urgent=True)
+        logger.info(f"Письмо для сброса пароля поставлено в очередь для {email}")
     except Exception as e:
         logger.error(f"Не удалось отправить письмо для сброса пароля на {email}: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+
+@shared_task
+def drain_email_outbox(urgent=False):
+    # A full batch means more may be due; keep going without waiting for Beat.
+    if drain_outbox(urgent=urgent) == BATCH_SIZE:
+        drain_email_outbox.delay()
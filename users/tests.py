@@ -0,0 +1,204 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core import mail
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from main.models import Product
+
+from . import emails
+from .models import CustomUser, OutgoingEmail, WishlistItem
+from .wishlist import add_products, remove_products, reorder_products
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+@mock.patch.object(emails, 'MAX_PER_SECOND', 10 ** 6)
+class EmailOutboxTests(TestCase):
+    def test_enqueue_dedupes_on_key(self):
+        emails.enqueue('welcome:a@example.com', 'a@example.com', 'Hi', 'Hello')
+        emails.enqueue('welcome:a@example.com', 'a@example.com', 'Hi', 'Hello')
+        self.assertEqual(OutgoingEmail.objects.count(), 1)
+
+    def test_drain_sends_batch_over_one_connection(self):
+        for i in range(3):
+            emails.enqueue(f'welcome:{i}', f'{i}@example.com', 'Hi', 'Hello', '<p>Hello</p>')
+        with mock.patch.object(emails, 'get_connection', wraps=emails.get_connection) as get_connection:
+            self.assertEqual(emails.drain_outbox(), 3)
+        get_connection.assert_called_once()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].alternatives[0].mimetype, 'text/html')
+        self.assertFalse(OutgoingEmail.objects.exclude(status=OutgoingEmail.SENT).exists())
+        self.assertEqual(emails.drain_outbox(), 0)
+
+    def test_urgent_drain_skips_bulk_backlog(self):
+        emails.enqueue('welcome:a', 'a@example.com', 'Hi', 'Hello')
+        emails.enqueue('password_reset:1:0', 'b@example.com', 'Reset', 'Link', urgent=True)
+        self.assertEqual(emails.drain_outbox(urgent=True), 1)
+        self.assertEqual([message.to for message in mail.outbox], [['b@example.com']])
+
+    def test_failed_send_is_retried_with_backoff(self):
+        emails.enqueue('welcome:a', 'a@example.com', 'Hi', 'Hello')
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            emails.drain_outbox()
+        email = OutgoingEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.PENDING, 1))
+        self.assertGreater(email.next_attempt_at, timezone.now() + timedelta(seconds=30))
+        self.assertEqual(emails.drain_outbox(), 0)
+
+        OutgoingEmail.objects.update(attempts=emails.MAX_ATTEMPTS - 1, next_attempt_at=timezone.now())
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            emails.drain_outbox()
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.FAILED)
+
+
+    def test_drain_that_dies_mid_batch_resends_only_unsent_messages(self):
+        for i in range(3):
+            emails.enqueue(f'welcome:{i}', f'{i}@example.com', 'Hi', 'Hello')
+        send_messages = mock.Mock(side_effect=[1, SystemExit])
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', send_messages):
+            with self.assertRaises(SystemExit):
+                emails.drain_outbox()
+        statuses = list(OutgoingEmail.objects.order_by('id').values_list('status', flat=True))
+        self.assertEqual(statuses, [OutgoingEmail.SENT, OutgoingEmail.SENDING, OutgoingEmail.SENDING])
+        self.assertEqual(emails.drain_outbox(), 0)
+
+        OutgoingEmail.objects.filter(status=OutgoingEmail.SENDING).update(next_attempt_at=timezone.now())
+        self.assertEqual(emails.drain_outbox(), 2)
+        self.assertEqual([message.to for message in mail.outbox], [['1@example.com'], ['2@example.com']])
+        self.assertFalse(OutgoingEmail.objects.exclude(status=OutgoingEmail.SENT).exists())
+
+
+class EmailTemplateTests(TestCase):
+    def test_render_inlines_css_and_escapes_html_only(self):
+        subject, text, html = emails.render_email('welcome', {'first_name': '<Ann>'})
+        self.assertEqual(subject, 'Добро пожаловать!')
+        self.assertIn('Привет, <Ann>,', text)
+        self.assertIn('&lt;Ann&gt;', html)
+        self.assertIn('<h1 style="margin: 0 0 24px;', html)
+        self.assertNotIn('class=', html)
+
+    def test_unknown_language_falls_back_to_default(self):
+        templates = emails.get_email_templates('password_reset', 'de-de')
+        self.assertEqual(
+            [template.origin.template_name for template in templates],
+            ['ru/password_reset.subject.txt', 'ru/password_reset.txt', 'ru/password_reset.html'],
+        )
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CachedAuthTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('a@example.com', 'ann', 'Ann', 'A', password='secret-pass-1')
+        self.client.force_login(self.user)
+
+    def get_auth_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/users/edit-account-details/', headers={'HX-Request': 'true'})
+        self.assertEqual(response.status_code, 200)
+        return response, [
+            query['sql'] for query in queries
+            if 'django_session' in query['sql'] or 'users_customuser' in query['sql']
+        ]
+
+    def test_warm_request_makes_no_auth_queries(self):
+        self.get_auth_queries()
+        self.assertEqual(self.get_auth_queries()[1], [])
+
+    def test_saving_the_user_drops_the_cached_copy(self):
+        self.get_auth_queries()
+        self.user.first_name = 'Bo'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response, queries = self.get_auth_queries()
+        self.assertContains(response, 'value="Bo"')
+        self.assertEqual(len(queries), 1)
+
+    def test_sessions_from_model_backend_stay_logged_in(self):
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        response = self.client.get('/users/edit-account-details/', headers={'HX-Request': 'true'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_password_change_logs_out_cached_sessions(self):
+        self.get_auth_queries()
+        self.user.set_password('other-pass-2')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response = self.client.get('/users/edit-account-details/')
+        self.assertEqual(response.status_code, 302)
+
+
+@mock.patch('main.popularity.record')
+@mock.patch('users.signals.refresh_recommendations')
+class WishlistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('a@example.com', 'ann', 'Ann', 'A', password='secret-pass-1')
+        cls.products = [Product.objects.create(name=f'P{i}', price=i, main_image='p.jpg') for i in range(4)]
+        cls.ids = [product.pk for product in cls.products]
+
+    def wishlist(self):
+        return list(WishlistItem.objects.filter(user=self.user).order_by('position').values_list('product_id', flat=True))
+
+    def test_add_products_appends_and_skips_existing(self, refresh, record):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(add_products(self.user, self.ids[:2]), (self.ids[:2], self.ids[:2]))
+        found, added = add_products(self.user, [self.ids[1], self.ids[2], 10 ** 9])
+        self.assertEqual((sorted(found), added), (self.ids[1:3], [self.ids[2]]))
+        self.assertEqual(self.wishlist(), self.ids[:3])
+        refresh.delay.assert_called_once_with([self.user.pk], self.ids[:2])
+        record.assert_called_once_with(dict.fromkeys(self.ids[:2], 1))
+
+    def test_remove_products_returns_removed(self, refresh, record):
+        add_products(self.user, self.ids)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(sorted(remove_products(self.user, [self.ids[0], self.ids[0], 10 ** 9])), [self.ids[0]])
+        self.assertEqual(self.wishlist(), self.ids[1:])
+        refresh.delay.assert_called_once_with([self.user.pk], [self.ids[0]])
+        record.assert_called_once_with({self.ids[0]: -1})
+
+    def test_reorder_products_moves_given_ids_to_front(self, refresh, record):
+        add_products(self.user, self.ids)
+        reorder_products(self.user, [self.ids[2], self.ids[0], self.ids[2]])
+        self.assertEqual(self.wishlist(), [self.ids[2], self.ids[0], self.ids[1], self.ids[3]])
+        positions = WishlistItem.objects.filter(user=self.user).order_by('position').values_list('position', flat=True)
+        self.assertEqual(list(positions), [1, 2, 3, 4])
+
+    def test_bulk_update_wishlist(self, refresh, record):
+        add_products(self.user, self.ids[:2])
+        self.client.force_login(self.user)
+        response = self.client.post(
+            '/users/wishlist/bulk/', {'add': [self.ids[2], 10 ** 9], 'remove': [self.ids[0]], 'order': [self.ids[2]]},
+            content_type='application/json',
+        )
+        self.assertEqual(response.json(), {
+            'added': [self.ids[2]], 'missing': [10 ** 9], 'removed': [self.ids[0]], 'reordered': 1,
+        })
+        self.assertEqual(self.wishlist(), [self.ids[2], self.ids[1]])
+        self.assertEqual(self.client.post('/users/wishlist/bulk/', {'add': ['x']}, content_type='application/json').status_code, 400)
+
+    def test_deleting_a_product_sends_one_batch(self, refresh, record):
+        other = CustomUser.objects.create_user('b@example.com', 'bob', 'Bob', 'B')
+        add_products(self.user, self.ids[:2])
+        add_products(other, self.ids[:1])
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            self.products[0].delete()
+        # The batch lookup and one fast DELETE; the items are never loaded one by one.
+        wishlist_queries = [query['sql'].split()[0] for query in queries if WishlistItem._meta.db_table in query['sql']]
+        self.assertEqual(wishlist_queries, ['SELECT', 'DELETE'])
+        refresh.delay.assert_called_once_with(sorted([self.user.pk, other.pk]), [self.ids[0]])
+        record.assert_called_once_with({self.ids[0]: -2})
+        self.assertEqual(self.wishlist(), [self.ids[1]])
+
+    def test_deleting_a_user_sends_one_batch(self, refresh, record):
+        user_id = self.user.pk
+        add_products(self.user, self.ids[:2])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        refresh.delay.assert_called_once_with([user_id], self.ids[:2])
+        record.assert_called_once_with(dict.fromkeys(self.ids[:2], -1))
@@ -1,6 +1,9 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+ProfileProductsView = views.AsyncProfileProductsView if settings.ASYNC_VIEWS else views.ProfileProductsView
+
 app_name = 'users'
 
 urlpatterns = [
@@ -17,6 +20,7 @@ urlpatterns = [
     # Product routes
     path('create_product/', views.create_product, name='create_product'),  
     path('delete/<int:product_id>/', views.DeleteUserProduct, name='delete_product'),
+    path('wishlist/bulk/', views.bulk_update_wishlist, name='bulk_update_wishlist'),
     
     # Password reset routes
     path('password-reset/', views.password_reset_request, name='password_reset_request'),
@@ -24,5 +28,6 @@ urlpatterns = [
     
     # Dynamic user routes - ДОЛЖНЫ БЫТЬ ПОСЛЕДНИМИ
     path('<str:login>/add/<int:product_id>/', views.add_product, name='add_product'),
-    path('<str:login>/', views.ProfileProductsView.as_view(), name='profile_products_view'),
+    path('<str:login>/export.<str:format>', views.export_wishlist, name='export_wishlist'),
+    path('<str:login>/', ProfileProductsView.as_view(), name='profile_products_view'),
 ]
\ No newline at end of file
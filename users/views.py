@@ -1,23 +1,34 @@
-from venv import logger
 from django.shortcuts import render, redirect , get_object_or_404
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse
 from django.template.response import TemplateResponse
 from .forms import CustomUserCreationForm, CustomUserLoginForm, CustomUserUpdateForm , AddProductForm, PasswordResetRequestForm, PasswordResetConfirmForm, UpdateProductForm
 from .tasks import send_welcome_email, send_password_reset_email
-from .models import CustomUser
+from .models import CustomUser, WishlistItem
+from .wishlist import add_products, remove_products, reorder_products
 from django.contrib import messages
 from main.models import Product, Category, ProductImage
+from main.images import queue_thumbnails
+from main import export
+from main.importer import unique_slugs
+from main.pagination import KeysetPaginator
 from django.views.generic import TemplateView, DetailView
+from django.db import transaction
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from wishlist.db_router import replica_reads
+from wishlist.instrumentation import query_budget
 from django.contrib.auth import update_session_auth_hash
 from slugify import slugify
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import  urlsafe_base64_decode
 from django.utils.encoding import force_str
+import json
 import logging
 
+logger = logging.getLogger(__name__)
 
 
 def register(request):
@@ -25,7 +36,7 @@ def register(request):
         form = CustomUserCreationForm(request.POST)
         if form.is_valid():
             user = form.save()
-            login(request, user, backend='django.contrib.auth.backends.ModelBackend')
+            login(request, user, backend='users.backends.CachedModelBackend')
             send_welcome_email.delay(user.email, user.first_name)
             logger.info(f"Welcome email task queued for {user.email}")
             if request.headers.get('HX-Request'):
@@ -47,7 +58,7 @@ def login_view(request):
         form = CustomUserLoginForm(request=request, data=request.POST)
         if form.is_valid():
             user = form.get_user()
-            login(request, user, backend='django.contrib.auth.backends.ModelBackend')
+            login(request, user, backend='users.backends.CachedModelBackend')
             if request.headers.get('HX-Request'):
                 response = HttpResponse()
                 response['HX-Redirect'] = reverse('main:index')
@@ -122,62 +133,127 @@ def logout_view(request):
     return redirect('main:index')
 
 
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+@method_decorator(replica_reads, name='dispatch')
+@method_decorator(query_budget(4), name='dispatch')
 class ProfileProductsView(TemplateView):
     template_name = 'main/product_view.html'
+    paginate_by = 24
+    CARD_FIELDS = ('product__id', 'product__name', 'product__slug', 'product__color',
+                   'product__price', 'product__main_image', 'product__thumbnail_widths')
+
+    def get_order(self):
+        order = self.request.GET.get('order')
+        return order if order in ('oldest', 'position') else 'newest'
+
+    def get_paginator(self, user):
+        items = WishlistItem.objects.filter(user=user).select_related('product').only(
+            'id', 'added_at', 'position', *self.CARD_FIELDS
+        )
+        order = self.get_order()
+        if order == 'position':
+            return KeysetPaginator(items, self.paginate_by, key='position', parse=int, descending=False)
+        return KeysetPaginator(items, self.paginate_by, key='added_at', descending=order == 'newest')
+
+    @staticmethod
+    def can_view(user, viewer):
+        return user.access or user.login == getattr(viewer, 'login', None)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        login = kwargs.get('login')
+        user = get_object_or_404(CustomUser.objects.only('id', 'login', 'access'), login=kwargs.get('login'))
+        page, next_cursor = [], None
+        if self.can_view(user, self.request.user):
+            page, next_cursor = self.get_paginator(user).get_page(self.request.GET.get('cursor'))
+        return self.update_context(context, user, page, next_cursor)
 
+    async def aget_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
         try:
-            user = CustomUser.objects.get(login=login)
-            products_ids = user.get_product_ids()
+            user = await CustomUser.objects.only('id', 'login', 'access').aget(login=kwargs.get('login'))
         except CustomUser.DoesNotExist:
-            products_ids = []
-        
-        context["login"] = login
-        context["access"] =user.access
-        context["products_list_ids"] = products_ids
+            raise Http404("No CustomUser matches the given query.")
+        page, next_cursor = [], None
+        if self.can_view(user, await self.request.auser()):
+            page, next_cursor = await self.get_paginator(user).aget_page(self.request.GET.get('cursor'))
+        return self.update_context(context, user, page, next_cursor)
+
+    def update_context(self, context, user, page, next_cursor):
+        next_page_url = None
+        if next_cursor:
+            params = self.request.GET.copy()
+            params['cursor'] = next_cursor
+            next_page_url = f"{self.request.path}?{params.urlencode()}"
+
+        context["login"] = user.login
+        context["access"] = user.access
+        context["products_list_ids"] = [item.product for item in page]
+        context["next_page_url"] = next_page_url
+        context["order"] = self.get_order()
         return context
 
-    def get(self, request, *args, **kwargs):
-        context = self.get_context_data(**kwargs)
+    def render_page(self, request, context):
         if request.headers.get("HX-Request"):
+            if request.GET.get('cursor'):
+                return TemplateResponse(request, "users/product_view_page.html", context)
             return TemplateResponse(request, "users/product_view_content.html", context)
         return TemplateResponse(request, "users/product_view.html", context)
 
+    def get(self, request, *args, **kwargs):
+        return self.render_page(request, self.get_context_data(**kwargs))
+
+
+class AsyncProfileProductsView(ProfileProductsView):
+    async def get(self, request, *args, **kwargs):
+        return self.render_page(request, await self.aget_context_data(**kwargs))
+
+
+@transaction.non_atomic_requests
+def export_wishlist(request, login, format):
+    """A wishlist as CSV, JSONL or a standalone HTML page to share,
+    streamed in the order ProfileProductsView takes from ``?order=``,
+    newest first by default like the view."""
+    if format not in export.FORMATS:
+        raise Http404("Unknown export format")
+    user = get_object_or_404(CustomUser.objects.only('id', 'login', 'access'), login=login)
+    if not ProfileProductsView.can_view(user, request.user):
+        raise Http404("No CustomUser matches the given query.")
+    order = request.GET.get('order')
+    order = order if order in export.WISHLIST_ORDERS else 'newest'
+    rows = export.wishlist_rows(user, request.build_absolute_uri('/'), order)
+    context = {'login': user.login, 'exported_at': timezone.now()}
+    return export.streaming_response(
+        request, format, export.render(format, rows, export.WISHLIST_COLUMNS, context), f'wishlist-{user.login}'
+    )
+
 
 def DeleteUserProduct(request, *args, **kwargs):
     product_id = kwargs.get('product_id')
     
     try:
-        user = request.user
-        login = user.login
-        if request.user.login != login:
+        if not request.user.is_authenticated:
             if request.headers.get('HX-Request'):
                 return HttpResponse(
                     '<button class="w-full  py-3 px-6 text-sm font-medium bg-black text-white cursor-not-allowed" disabled>ACCESS DENIED</button>'
                 )
-            return redirect('users:profile_products_view', login=request.user.login)
-    
-        product = user.products.get(id=product_id)
-            
-        if product:
-            user.products.remove(product)
+            return redirect('users:login')
+
+        if remove_products(request.user, [product_id]):
             if request.headers.get('HX-Request'):
-                    response = HttpResponse()
-                    response['HX-Redirect'] = reverse('users:profile_products_view', kwargs={'login': request.user.login})
-                    return response
+                response = HttpResponse()
+                response['HX-Redirect'] = reverse('users:profile_products_view', kwargs={'login': request.user.login})
+                return response
         else:
             return HttpResponse(
                 '<button class="w-full  py-3 px-6 text-sm font-medium bg-black text-white cursor-not-allowed" disabled>Product doesnt exists</button>'
             )
     except Exception as e:
-        print(f"Error adding product: {e}")
+        logger.exception(f"Error deleting product {product_id}: {e}")
         if request.headers.get('HX-Request'):
             return HttpResponse(
                 '<button class="w-full  py-3 px-6 text-sm font-medium bg-black text-white cursor-not-allowed" disabled>ERROR</button>'
             )
-    return redirect('users:profile_products_view', login=login)
+    return redirect('users:profile_products_view', login=request.user.login)
 
 
 @login_required
@@ -193,23 +269,18 @@ def add_product(request, *args, **kwargs):
         return redirect('users:profile_products_view', login=request.user.login)
     
     try:
-        user = get_object_or_404(CustomUser, login=login)
-        product = get_object_or_404(Product, id=product_id)
-        
-        if user.products.filter(id=product_id).exists():
-            if request.headers.get('HX-Request'):
-                return HttpResponse (
-                    '<button class="w-full  py-3 px-6 text-sm font-medium bg-black text-white cursor-not-allowed" disabled>ALREADY IN WISHLIST</button>'
-                )
-        else:
-            user.products.add(product)
-            if request.headers.get('HX-Request'):
-                return HttpResponse(
-                    '<button class="w-full  py-3 px-6 text-sm font-medium bg-black text-white cursor-not-allowed" disabled>ADDED TO WISHLIST</button>'
-                )
-            
+        found, added = add_products(request.user, [product_id])
+        if not found:
+            raise Http404("Product not found")
+        if request.headers.get('HX-Request'):
+            label = 'ADDED TO WISHLIST' if added else 'ALREADY IN WISHLIST'
+            return HttpResponse(
+                f'<button class="w-full  py-3 px-6 text-sm font-medium bg-black text-white cursor-not-allowed" disabled>{label}</button>'
+            )
+    except Http404:
+        raise
     except Exception as e:
-        print(f"Error adding product: {e}")
+        logger.exception(f"Error adding product {product_id}: {e}")
         if request.headers.get('HX-Request'):
             return HttpResponse(
                 '<button class="w-full  py-3 px-6 text-sm font-medium bg-black text-white cursor-not-allowed" disabled>ERROR</button>'
@@ -219,6 +290,32 @@ def add_product(request, *args, **kwargs):
     return redirect('users:profile_products_view', login=login)
 
 
+@login_required
+def bulk_update_wishlist(request):
+    """Apply ``{"add": [...], "remove": [...], "order": [...]}`` to the
+    current user's wishlist, one statement per key that is present."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    try:
+        payload = json.loads(request.body or b'{}')
+        add = [int(pk) for pk in payload.get('add', [])]
+        remove = [int(pk) for pk in payload.get('remove', [])]
+        order = [int(pk) for pk in payload.get('order', [])]
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'error': 'Expected JSON lists of product ids'}, status=400)
+
+    result = {}
+    if add:
+        found, added = add_products(request.user, add)
+        result['added'] = added
+        result['missing'] = sorted(set(add) - set(found))
+    if remove:
+        result['removed'] = remove_products(request.user, remove)
+    if order:
+        result['reordered'] = reorder_products(request.user, order)
+    return JsonResponse(result)
+
+
 @login_required
 def create_product(request):
     if request.method == 'POST':
@@ -232,8 +329,10 @@ def create_product(request):
             product = form.save(commit=False)
             product.category = category
             product.url = form.cleaned_data.get('url', '') 
+            product.slug = unique_slugs([product.name])[0]
             product.save()
-            request.user.products.add(product)
+            queue_thumbnails(product)
+            add_products(request.user, [product.pk])
             
             if request.headers.get('HX-Request'):
                 response = HttpResponse()
@@ -314,9 +413,11 @@ def update_product_details(request, product_id):
                 )
                 product.category = category
             product.save()
+            if 'main_image' in request.FILES:
+                queue_thumbnails(product)
             extra_image = request.FILES.get('extra_image')
             if extra_image:
-                ProductImage.objects.create(product=product, image=extra_image)
+                queue_thumbnails(ProductImage.objects.create(product=product, image=extra_image))
             
             if request.headers.get('HX-Request'):
                 response = HttpResponse()
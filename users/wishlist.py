@@ -0,0 +1,90 @@
+"""Set-based wishlist writes: each function is a single SQL statement,
+whatever the number of products."""
+from django.db import connections, router
+from django.dispatch import Signal
+
+from .models import WishlistItem
+
+TABLE = WishlistItem._meta.db_table
+
+# Sent once per write with ``items``, the (user id, product id) pairs it
+# added or removed, and ``delta``: 1 for added, -1 for removed. Receivers
+# do the popularity and recommendation bookkeeping for the whole batch.
+wishlist_changed = Signal()
+
+ADD_SQL = f"""
+WITH found AS (
+    SELECT id FROM main_product WHERE id = ANY(%(product_ids)s::bigint[])
+),
+added AS (
+    INSERT INTO {TABLE} (customuser_id, product_id, added_at, position, note)
+    SELECT %(user_id)s, found.id, now(),
+           COALESCE((SELECT max(position) FROM {TABLE} WHERE customuser_id = %(user_id)s), 0)
+           + row_number() OVER (ORDER BY array_position(%(product_ids)s::bigint[], found.id)),
+           ''
+    FROM found
+    ON CONFLICT (customuser_id, product_id) DO NOTHING
+    RETURNING product_id
+)
+SELECT (SELECT array_agg(id) FROM found), (SELECT array_agg(product_id) FROM added)
+"""
+
+REMOVE_SQL = f"""
+DELETE FROM {TABLE}
+WHERE customuser_id = %(user_id)s AND product_id = ANY(%(product_ids)s::bigint[])
+RETURNING product_id
+"""
+
+REORDER_SQL = f"""
+UPDATE {TABLE} AS item
+SET position = numbered.position
+FROM (
+    SELECT item.id, row_number() OVER (
+        ORDER BY ordering.rank NULLS LAST, item.position, item.id
+    ) AS position
+    FROM {TABLE} AS item
+    LEFT JOIN unnest(%(product_ids)s::bigint[]) WITH ORDINALITY AS ordering(product_id, rank)
+        ON ordering.product_id = item.product_id
+    WHERE item.customuser_id = %(user_id)s
+) AS numbered
+WHERE item.id = numbered.id AND item.position <> numbered.position
+"""
+
+
+def _cursor():
+    return connections[router.db_for_write(WishlistItem)].cursor()
+
+
+def _changed(user, product_ids, delta):
+    if product_ids:
+        wishlist_changed.send(sender=WishlistItem, items=[(user.pk, pk) for pk in product_ids], delta=delta)
+
+
+def add_products(user, product_ids):
+    """Append ``product_ids`` to the end of ``user``'s wishlist, skipping
+    ones already there. Returns (ids of existing products, ids added)."""
+    with _cursor() as cursor:
+        cursor.execute(ADD_SQL, {'user_id': user.pk, 'product_ids': [int(pk) for pk in product_ids]})
+        found, added = cursor.fetchone()
+    found, added = found or [], added or []
+    _changed(user, added, 1)
+    return found, added
+
+
+def remove_products(user, product_ids):
+    """Returns the ids that were actually in the wishlist."""
+    with _cursor() as cursor:
+        cursor.execute(REMOVE_SQL, {'user_id': user.pk, 'product_ids': [int(pk) for pk in product_ids]})
+        removed = [row[0] for row in cursor.fetchall()]
+    _changed(user, removed, -1)
+    return removed
+
+
+def reorder_products(user, product_ids):
+    """Move the given products to the front of the wishlist in that order;
+    the rest follow in their current order. Returns the rows renumbered."""
+    # A repeated id would join its row twice and number it twice.
+    product_ids = list(dict.fromkeys(int(pk) for pk in product_ids))
+    with _cursor() as cursor:
+        cursor.execute(REORDER_SQL, {'user_id': user.pk, 'product_ids': product_ids})
+        return cursor.rowcount
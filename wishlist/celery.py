@@ -1,13 +1,44 @@
 import os
 from celery import Celery
+from kombu import Queue
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wishlist.settings')
 
 app = Celery('wishlist')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
+# Each queue has its own worker in docker-compose.yml, so a thumbnail
+# backlog or a nightly rebuild never delays a mail a user is waiting for.
+#   interactive: a user is waiting on the result.
+#   bulk: user-triggered background work.
+#   maintenance: Beat jobs.
+app.conf.task_queues = (
+    Queue('interactive'),
+    Queue('bulk'),
+    Queue('maintenance'),
+)
+app.conf.task_default_queue = 'bulk'
+app.conf.task_routes = {
+    'users.tasks.send_password_reset_email': {'queue': 'interactive'},
+    'users.tasks.send_welcome_email': {'queue': 'bulk'},
+    'users.tasks.drain_email_outbox': {'queue': 'maintenance'},
+    'main.tasks.generate_image_thumbnails': {'queue': 'bulk'},
+    'main.tasks.fetch_product_image': {'queue': 'bulk'},
+    'main.tasks.import_products_file': {'queue': 'bulk'},
+    'main.tasks.refresh_recommendations': {'queue': 'bulk'},
+    'main.tasks.rebuild_recommendations': {'queue': 'maintenance'},
+    'main.tasks.flush_popularity': {'queue': 'maintenance'},
+    'main.tasks.decay_trending': {'queue': 'maintenance'},
+    'main.tasks.rebuild_home_feed': {'queue': 'maintenance'},
+    'main.tasks.prune_task_results': {'queue': 'maintenance'},
+}
+# Workers reserve one task per process at a time; long tasks then cannot
+# hold short ones hostage in a prefetch buffer. The bulk worker raises
+# this on its command line.
+app.conf.worker_prefetch_multiplier = 1
+
 app.autodiscover_tasks()
 
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
-    print(f'Request: {self.request!r}')
\ No newline at end of file
+    print(f'Request: {self.request!r}')
@@ -0,0 +1,159 @@
+"""Read replica routing.
+
+Views decorated with ``replica_reads`` send their ORM reads to the
+``replica`` database when one is configured; everything else, and every
+write, uses ``default``. A request that writes sets a cookie that pins
+the browser to the primary for REPLICA_PIN_SECONDS, so users always
+read their own writes even if the replica lags behind.
+
+Other browsers are not pinned, so cache generation bumps also record the
+primary's WAL position, and a request that reads a generation stops using
+the replica until it has replayed that far. Otherwise a lagging replica
+would render old rows into fragments and ETags keyed on the new generation.
+"""
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA = 'replica'
+PIN_COOKIE = 'db_pin'
+WAL_POSITION_KEY = 'replica:wal_position'
+
+_use_replica = ContextVar('use_replica', default=False)
+_wrote = ContextVar('wrote', default=False)
+# Highest position this process has seen the replica replay; it only grows.
+_replayed = 0
+
+
+def replica_reads(view_func):
+    """Mark a read-only view as safe to serve from the replica. For class
+    based views, apply it to ``dispatch`` with ``method_decorator``."""
+    view_func.replica_reads = True
+    return view_func
+
+
+def reads_from_replica():
+    return _use_replica.get() and REPLICA in settings.DATABASES
+
+
+def _primary_position():
+    with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+        cursor.execute("SELECT pg_current_wal_lsn() - '0/0'")
+        return int(cursor.fetchone()[0])
+
+
+def _replica_position():
+    # A server that is not in recovery has nothing left to replay.
+    with connections[REPLICA].cursor() as cursor:
+        cursor.execute("SELECT COALESCE(pg_last_wal_replay_lsn(), pg_current_wal_lsn()) - '0/0'")
+        return int(cursor.fetchone()[0])
+
+
+def record_write():
+    """Store the primary's current WAL position, which covers every write
+    committed so far. Call it after a commit and before bumping the cache
+    generations it invalidates. The stored position only moves forward:
+    concurrent callers raise it with ``incr``, never lower it."""
+    if REPLICA not in settings.DATABASES:
+        return None
+    position = _primary_position()
+    if not cache.add(WAL_POSITION_KEY, position, timeout=None):
+        recorded = cache.get(WAL_POSITION_KEY, position)
+        if recorded < position:
+            try:
+                cache.incr(WAL_POSITION_KEY, position - recorded)
+            except ValueError:
+                cache.set(WAL_POSITION_KEY, position, timeout=None)
+    return position
+
+
+def check_replica_lag():
+    """Send the rest of this request's reads to the primary unless the
+    replica has replayed the position stored by ``record_write``. Call it
+    after reading cache generations and before the reads they key. Returns
+    whether the request moved to the primary."""
+    global _replayed
+    if not reads_from_replica():
+        return False
+    recorded = cache.get(WAL_POSITION_KEY)
+    if recorded is None:
+        recorded = record_write()
+    if _replayed < recorded:
+        _replayed = max(_replayed, _replica_position())
+    if _replayed >= recorded:
+        return False
+    _use_replica.set(False)
+    return True
+
+
+async def acheck_replica_lag():
+    if not reads_from_replica():
+        return False
+    recorded = await cache.aget(WAL_POSITION_KEY)
+    if recorded is not None and _replayed >= recorded:
+        return False
+    return await sync_to_async(check_replica_lag)()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and REPLICA in settings.DATABASES:
+            return REPLICA
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        replica_token = _use_replica.set(False)
+        wrote_token = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            wrote = _wrote.get()
+        finally:
+            _use_replica.reset(replica_token)
+            _wrote.reset(wrote_token)
+        return self.pin(response, wrote)
+
+    async def __acall__(self, request):
+        replica_token = _use_replica.set(False)
+        wrote_token = _wrote.set(False)
+        try:
+            response = await self.get_response(request)
+            wrote = _wrote.get()
+        finally:
+            _use_replica.reset(replica_token)
+            _wrote.reset(wrote_token)
+        return self.pin(response, wrote)
+
+    def pin(self, response, wrote):
+        if wrote:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if getattr(view_func, 'replica_reads', False) and PIN_COOKIE not in request.COOKIES:
+            _use_replica.set(True)
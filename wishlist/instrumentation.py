@@ -0,0 +1,200 @@
+"""Per-request performance metrics.
+
+RequestMetricsMiddleware counts SQL queries and their time, template
+render time and cache hits/misses for each request. It reports them in a
+``Server-Timing`` header (when SERVER_TIMING is on) and a log line on the
+``wishlist.requests`` logger. Views declare how many queries they may run
+with ``query_budget``; going over it logs a warning, or raises
+QueryBudgetExceeded when QUERY_BUDGET_RAISE is set, as it is under
+``manage.py test``.
+
+Templates and the cache only report when configured through the
+DjangoTemplates and RedisCache backends below.
+"""
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache.backends.redis import RedisCache as BaseRedisCache
+from django.db import connections
+from django.template.backends.django import DjangoTemplates as BaseDjangoTemplates
+from django.template.backends.django import Template as BaseTemplate
+
+logger = logging.getLogger('wishlist.requests')
+
+_metrics = ContextVar('request_metrics', default=None)
+# Set while get_many runs, for backends that implement it with get().
+_in_get_many = ContextVar('in_get_many', default=False)
+_MISSING = object()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(queries):
+    """Declare that a view runs at most ``queries`` SQL queries, counting
+    session and user lookups. For class based views, apply it to
+    ``dispatch`` with ``method_decorator``."""
+    def decorator(view_func):
+        view_func.query_budget = queries
+        return view_func
+    return decorator
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.budget = None
+
+    def as_dict(self):
+        return {
+            'duration_ms': round((time.perf_counter() - self.started) * 1000, 1),
+            'queries': self.queries,
+            'query_ms': round(self.query_time * 1000, 1),
+            'template_ms': round(self.template_time * 1000, 1),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'query_budget': self.budget,
+        }
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = _metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.query_time += time.perf_counter() - started
+
+
+def _instrument_connections():
+    for alias in connections:
+        wrappers = connections[alias].execute_wrappers
+        if record_query not in wrappers:
+            # First, so connection.execute_wrapper() blocks still pop their own.
+            wrappers.insert(0, record_query)
+
+
+def _record_cache(hits, misses):
+    metrics = _metrics.get()
+    if metrics is not None:
+        metrics.cache_hits += hits
+        metrics.cache_misses += misses
+
+
+class CacheMetricsMixin:
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version)
+        if not _in_get_many.get():
+            _record_cache(value is not _MISSING, value is _MISSING)
+        return default if value is _MISSING else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        token = _in_get_many.set(True)
+        try:
+            values = super().get_many(keys, version)
+        finally:
+            _in_get_many.reset(token)
+        _record_cache(len(values), len(keys) - len(values))
+        return values
+
+
+class RedisCache(CacheMetricsMixin, BaseRedisCache):
+    pass
+
+
+class Template(BaseTemplate):
+    def render(self, context=None, request=None):
+        metrics = _metrics.get()
+        if metrics is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - started
+
+
+class DjangoTemplates(BaseDjangoTemplates):
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name).template, self)
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        _instrument_connections()
+        metrics = RequestMetrics()
+        token = _metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        return self.report(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        return self.report(request, response, metrics)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Connections are per thread; under ASGI this runs on the thread
+        # that serves the request's ORM calls.
+        _instrument_connections()
+        metrics = _metrics.get()
+        if metrics is not None:
+            metrics.budget = getattr(view_func, 'query_budget', None)
+
+    def report(self, request, response, metrics):
+        values = metrics.as_dict()
+        logger.info(
+            '%s %s %s %sms queries=%s db=%sms templates=%sms cache=%s/%s',
+            request.method, request.path, response.status_code, values['duration_ms'], values['queries'],
+            values['query_ms'], values['template_ms'], values['cache_hits'], values['cache_misses'],
+            extra={'request_metrics': {'method': request.method, 'path': request.path,
+                                       'status': response.status_code, **values}},
+        )
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={values["query_ms"]};desc="{values["queries"]} queries"',
+                f'tpl;dur={values["template_ms"]}',
+                f'cache;desc="{values["cache_hits"]} hits, {values["cache_misses"]} misses"',
+                f'total;dur={values["duration_ms"]}',
+            ])
+        if metrics.budget is not None and metrics.queries > metrics.budget:
+            message = (
+                f'{request.method} {request.path} ran {metrics.queries} queries, '
+                f'over its budget of {metrics.budget}'
+            )
+            if settings.QUERY_BUDGET_RAISE:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
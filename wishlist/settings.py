@@ -6,6 +6,7 @@ from pathlib import Path
 import os
 import sys
 from dotenv import load_dotenv
+from celery.schedules import crontab
 
 load_dotenv()
 
@@ -46,13 +47,16 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'django_celery_results',
     'main',
     'users',
 ]
 
 MIDDLEWARE = [
+    'wishlist.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'wishlist.db_router.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -63,9 +67,22 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'wishlist.urls'
 
+# Request metrics (wishlist.instrumentation): Server-Timing headers for the
+# browser's devtools, and whether a view over its query_budget raises
+# instead of logging a warning.
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+SERVER_TIMING = os.getenv('SERVER_TIMING', str(DEBUG)).lower() == 'true'
+QUERY_BUDGET_RAISE = TESTING
+
+# 'wsgi' (gunicorn sync workers) or 'asgi' (uvicorn workers), see
+# gunicorn.conf.py. The ASGI profile serves the async catalog, product
+# and wishlist views.
+SERVER_PROFILE = os.getenv('SERVER_PROFILE', 'wsgi')
+ASYNC_VIEWS = SERVER_PROFILE == 'asgi'
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'wishlist.instrumentation.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -81,6 +98,11 @@ TEMPLATES = [
 WSGI_APPLICATION = 'wishlist.wsgi.application'
 
 # Database
+# Connections are reused across requests: persistent (CONN_MAX_AGE seconds,
+# checked before reuse) by default, or from a psycopg 3 pool with DB_POOL=true
+# (Django forbids persistent connections then).
+DB_POOL = os.getenv('DB_POOL', '').lower() in ('1', 'true', 'yes')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -89,10 +111,57 @@ DATABASES = {
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('POSTGRES_HOST', 'db'),  
         'PORT': os.getenv('POSTGRES_PORT', '5432'),
+        # Read-only views opt out with transaction.non_atomic_requests.
         'ATOMIC_REQUESTS': True,
+        'CONN_MAX_AGE': 0 if DB_POOL else int(os.getenv('CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'pool': {
+                'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+                'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+            },
+        } if DB_POOL else {},
     }
 }
 
+# Optional streaming replica for views marked with db_router.replica_reads.
+if os.getenv('POSTGRES_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.getenv('POSTGRES_REPLICA_HOST'),
+        'PORT': os.getenv('POSTGRES_REPLICA_PORT', DATABASES['default']['PORT']),
+        'ATOMIC_REQUESTS': False,
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['wishlist.db_router.ReplicaRouter']
+# How long a browser reads from the primary after one of its requests wrote.
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '15'))
+
+# Cache
+REDIS_CACHE_URL = os.getenv('REDIS_CACHE_URL', 'redis://redis:6379/1')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'wishlist.instrumentation.RedisCache',
+        'LOCATION': REDIS_CACHE_URL,
+        'KEY_PREFIX': 'wishlist',
+    }
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'wishlist.requests': {
+            'handlers': ['console'],
+            'level': os.getenv('REQUEST_LOG_LEVEL', 'WARNING' if TESTING else 'INFO'),
+        },
+    },
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -129,15 +198,60 @@ MEDIA_ROOT = '/app/media/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.CustomUser'
+# request.user and the session both come from Redis; the session table is
+# only read when the cache misses.
+# Sessions from before the cached backend name ModelBackend; keeping it
+# listed keeps them logged in, new logins use the cached one.
+AUTHENTICATION_BACKENDS = [
+    'users.backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
 LOGOUT_REDIRECT_URL = 'main:index'
 
 # Celery settings
 CELERY_BROKER_URL = 'redis://redis:6379/0'  
-CELERY_RESULT_BACKEND = 'django-db'
+# Tasks are fire-and-forget unless declared with ignore_result=False;
+# those results go to Redis and expire instead of piling up in Postgres.
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://redis:6379/2')
+CELERY_RESULT_EXPIRES = 60 * 60 * 24
+# Rows left in django_celery_results' table from the old django-db backend
+# are pruned by main.tasks.prune_task_results.
+TASK_RESULT_RETENTION_DAYS = 7
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+CELERY_BEAT_SCHEDULE = {
+    'rebuild-recommendations': {
+        'task': 'main.tasks.rebuild_recommendations',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'flush-popularity': {
+        'task': 'main.tasks.flush_popularity',
+        'schedule': 60.0,
+    },
+    'decay-trending': {
+        'task': 'main.tasks.decay_trending',
+        'schedule': crontab(minute=0),
+    },
+    'drain-email-outbox': {
+        'task': 'users.tasks.drain_email_outbox',
+        'schedule': 60.0,
+    },
+    'prune-task-results': {
+        'task': 'main.tasks.prune_task_results',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    'rebuild-home-feed': {
+        'task': 'main.tasks.rebuild_home_feed',
+        'schedule': crontab(minute='*/5'),
+    },
+}
+
+# Buffered wishlist counters (main.popularity), flushed by flush-popularity.
+POPULARITY_REDIS_URL = os.getenv('POPULARITY_REDIS_URL', REDIS_CACHE_URL)
 
 # Email settings
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'